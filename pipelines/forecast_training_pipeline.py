@@ -0,0 +1,136 @@
+import joblib
+import numpy as np
+from sklearn.metrics import mean_absolute_error
+
+import src.config as config
+from src.data_utils import (
+    load_ts_windows_memmap,
+    ts_windows_frame,
+    write_ts_windows_memmap,
+)
+from src.inference import (
+    fetch_days_data,
+    get_hopsworks_session_stats,
+    get_model_registry,
+    get_model_schema,
+    load_model_from_registry,
+)
+from src.lag_selection import save_lag_columns
+from src.pipeline_utils import (
+    MultiHorizonRegressor,
+    get_pipeline,
+    model_lags,
+    retrain_parameters,
+    write_model_input,
+)
+
+HORIZON = config.FORECAST_HORIZON
+
+# ─────────────────────────────────────────────────────────────
+# Step 1: Load data and the registered next-hour model
+# ─────────────────────────────────────────────────────────────
+# The forecaster reuses the next-hour model's (pruned) lags and
+# hyperparameters, so it needs no lag ranking or tuning of its own.
+print("📥 Fetching CitiBike time-series data from Hopsworks...")
+ts_data = fetch_days_data(
+    config.TRAINING_HISTORY_DAYS, columns=["start_station_id", "start_hour", "rides"]
+)
+ts_data = ts_data.sort_values(["start_station_id", "start_hour"]).reset_index(drop=True)
+
+next_hour_model = load_model_from_registry()
+lags = model_lags(next_hour_model)
+best_parameters = retrain_parameters(next_hour_model)
+print(f"🧩 Using {len(lags)} lags and {best_parameters} from the next-hour model")
+
+# ─────────────────────────────────────────────────────────────
+# Step 2: Transform to windows with HORIZON targets each
+# ─────────────────────────────────────────────────────────────
+# Every window carries the next HORIZON hours as targets, so all
+# per-horizon boosters share one feature matrix.
+print(f"🧪 Transforming time-series data into features/targets for {HORIZON} hours ahead...")
+WINDOW_SIZE = 24 * 28
+STEP_SIZE = 23
+MEMORY_BUDGET_MB = 512
+
+write_ts_windows_memmap(
+    ts_data,
+    config.FORECAST_WINDOWS_DIR,
+    window_size=WINDOW_SIZE,
+    step_size=STEP_SIZE,
+    memory_budget_mb=MEMORY_BUDGET_MB,
+    dtype="float32",
+    sort_by_time=True,
+    lags=lags,
+    horizon=HORIZON,
+)
+del ts_data
+windows = load_ts_windows_memmap(config.FORECAST_WINDOWS_DIR)
+print(f"💾 {windows['metadata']['n_windows']} windows written to {config.FORECAST_WINDOWS_DIR}")
+
+pipeline = get_pipeline(feature_dtype="float32", lag_columns=[f"rides_t-{lag}" for lag in lags])
+model_input_path = config.FORECAST_WINDOWS_DIR / "model_input.npy"
+model_input, feature_names = write_model_input(pipeline, windows, model_input_path)
+targets = np.asarray(windows["targets"])
+
+# ─────────────────────────────────────────────────────────────
+# Step 3: Evaluate on the latest week
+# ─────────────────────────────────────────────────────────────
+# Training windows must end before the test week, so windows whose later
+# targets fall into it are left out of training as well.
+hours = np.asarray(windows["start_hours"])
+test_start_hour = hours[-1] + np.timedelta64(1, "h") - np.timedelta64(config.BACKTEST_TEST_DAYS * 24, "h")
+test_start = int(np.searchsorted(hours, test_start_hour))
+train_stop = int(np.searchsorted(hours, test_start_hour - np.timedelta64(HORIZON - 1, "h")))
+
+print(f"🧮 Training {HORIZON} boosters on {train_stop} windows...")
+regressor = MultiHorizonRegressor(best_parameters).fit(
+    model_input[:train_stop], targets[:train_stop], feature_name=feature_names
+)
+horizon_mae = mean_absolute_error(
+    targets[test_start:], regressor.predict(model_input[test_start:]), multioutput="raw_values"
+)
+test_mae = horizon_mae.mean()
+print(f"📉 Latest week MAE per hour ahead: {np.round(horizon_mae, 4).tolist()}")
+print(f"📉 Latest week MAE: {test_mae:.4f}")
+
+# A registered forecaster is only comparable when it reads a subset of
+# these lags and forecasts as many hours
+champion_mae = None
+if get_model_registry().get_models(name=config.FORECAST_MODEL_NAME):
+    champion = load_model_from_registry(name=config.FORECAST_MODEL_NAME)
+    if set(model_lags(champion)) <= set(lags) and len(champion[-1].boosters_) == HORIZON:
+        features, _ = ts_windows_frame(windows, slice(test_start, None))
+        champion_mae = mean_absolute_error(targets[test_start:], champion.predict(features))
+        print(f"📈 Registered forecaster MAE on the latest week: {champion_mae:.4f}")
+
+# ─────────────────────────────────────────────────────────────
+# Step 4: Train on all windows and register if improved
+# ─────────────────────────────────────────────────────────────
+if champion_mae is None or test_mae < champion_mae:
+    print("✅ Training the forecaster on all windows and registering...")
+    pipeline.steps[-1] = (
+        "multihorizonregressor",
+        MultiHorizonRegressor(best_parameters).fit(model_input, targets, feature_name=feature_names),
+    )
+
+    model_dir = config.MODELS_DIR / "citibike_demand_forecaster"
+    model_dir.mkdir(parents=True, exist_ok=True)
+    joblib.dump(pipeline, model_dir / "lgb_model.pkl")
+    save_lag_columns(lags, model_dir / "lag_columns.json")
+
+    # The schema only needs the column layout, so a slice of the windows will do
+    features, targets = ts_windows_frame(windows, slice(0, 100))
+
+    metrics = {"test_mae": test_mae}
+    metrics.update({f"mae_t+{h}": mae for h, mae in enumerate(horizon_mae, start=1)})
+    model = get_model_registry().sklearn.create_model(
+        name=config.FORECAST_MODEL_NAME,
+        metrics=metrics,
+        input_example=features.sample(),
+        model_schema=get_model_schema(features, targets),
+    )
+    model.save(str(model_dir))
+else:
+    print("🚫 New forecaster did not beat the registered one. Skipping registration.")
+
+print(f"🔐 Hopsworks session: {get_hopsworks_session_stats()}")
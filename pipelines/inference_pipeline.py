@@ -1,3 +1,4 @@
+import sys
 from datetime import datetime, timedelta
 import pandas as pd
 
@@ -6,16 +7,23 @@ from src.inference import (
     get_feature_store,
     get_model_predictions,
     load_model_from_registry,
+    write_forecast_predictions,
 )
-from src.data_utils import transform_ts_data_into_lag_features  # replace this if your lag builder is elsewhere
+from src.data_utils import transform_ts_data_latest_window_bike
+from src.pipeline_utils import export_lean_predictor, model_lags
+
+# --multi-horizon to forecast the next FORECAST_HORIZON hours with the
+# multi-horizon model instead of the next hour only
+multi_horizon = "--multi-horizon" in sys.argv
 
 # Current timestamp in UTC
 current_date = pd.Timestamp.now(tz="Etc/UTC")
 feature_store = get_feature_store()
 
-# Define fetch window: last 28 days
+# Define fetch window: last 29 days, so every station has the 672 closed
+# hours of its latest window whatever minute the job runs at
 fetch_data_to = current_date - timedelta(hours=1)
-fetch_data_from = current_date - timedelta(days=28)
+fetch_data_from = current_date - timedelta(days=29)
 print(f"Fetching features from {fetch_data_from} to {fetch_data_to}")
 
 # Load from CitiBike hourly feature view
@@ -34,25 +42,43 @@ ts_data = ts_data[ts_data.start_hour.between(fetch_data_from, fetch_data_to)]
 ts_data = ts_data.sort_values(["start_station_id", "start_hour"]).reset_index(drop=True)
 ts_data["start_hour"] = ts_data["start_hour"].dt.tz_localize(None)
 
-# Transform into lag features
-features = transform_ts_data_into_lag_features(
+# NumPy-only predictor exported from the registered pipeline
+model_name = config.FORECAST_MODEL_NAME if multi_horizon else config.MODEL_NAME
+model = export_lean_predictor(load_model_from_registry(name=model_name))
+
+# Only the latest 672-hour window of each station is needed, also for the
+# later hours of the multi-horizon model, and only the lag columns the
+# (pruned) model reads are built
+features = transform_ts_data_latest_window_bike(
     ts_data,
     window_size=24 * 28,
-    step_size=23
+    dtype="float32",
+    lags=model_lags(model),
 )
 
 # Run model inference
-model = load_model_from_registry()
-predictions = get_model_predictions(model, features)
-predictions["prediction_hour"] = current_date.ceil("h")
-
-# Push predictions into Hopsworks feature group
-pred_fg = feature_store.get_or_create_feature_group(
-    name=config.FEATURE_GROUP_MODEL_PREDICTION,
-    version=1,
-    description="CitiBike hourly demand predictions",
-    primary_key=["start_station_id", "prediction_hour"],
-    event_time="prediction_hour",
+predictions = get_model_predictions(
+    model,
+    features,
+    n_workers=config.INFERENCE_WORKERS,
+    chunk_size=config.INFERENCE_CHUNK_SIZE,
 )
 
-pred_fg.insert(predictions, write_options={"wait_for_job": False})
+if multi_horizon:
+    # All stations and hours ahead are written as one batch
+    write_forecast_predictions(predictions, features, current_date)
+else:
+    # Each window predicts its own start_hour, the hour after its last
+    # closed hour (the current hour when the job runs mid-hour)
+    predictions["prediction_hour"] = pd.DatetimeIndex(features["start_hour"]).tz_localize("Etc/UTC")
+
+    # Push predictions into Hopsworks feature group
+    pred_fg = feature_store.get_or_create_feature_group(
+        name=config.FEATURE_GROUP_MODEL_PREDICTION,
+        version=1,
+        description="CitiBike hourly demand predictions",
+        primary_key=["start_station_id", "prediction_hour"],
+        event_time="prediction_hour",
+    )
+
+    pred_fg.insert(predictions, write_options={"wait_for_job": False})
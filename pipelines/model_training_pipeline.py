@@ -1,34 +1,144 @@
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
 import joblib
-from hsml.model_schema import ModelSchema
-from hsml.schema import Schema
-from sklearn.metrics import mean_absolute_error
+import pandas as pd
 
 import src.config as config
-from src.data_utils import transform_ts_data_info_features_and_target_bike
+from src.backtest import run_backtest
+from src.dataset_cache import DatasetCache
+from src.data_utils import (
+    load_ts_windows_memmap,
+    ts_windows_frame,
+    write_ts_windows_memmap,
+)
+from src.lag_selection import rank_lags_by_gain, save_lag_columns, select_lags
 from src.inference import (
     fetch_days_data,
     get_hopsworks_project,
+    get_hopsworks_session_stats,
+    get_model_registry,
+    get_model_schema,
     load_metrics_from_registry,
+    load_model_from_registry,
 )
-from src.pipeline_utils import get_pipeline
+from src.pipeline_utils import BoosterRegressor, get_pipeline, model_lags, write_model_input
+from src.tuning import tune_hyperparameters
+from src.warm_start import full_retrain_reason, history_days_needed, warm_start_update
+
+# --tune to search the hyperparameters instead of using best_parameters,
+# --full to retrain from scratch instead of updating the registered model
+tune = "--tune" in sys.argv
+full = "--full" in sys.argv or tune
+
+
+def register_model(pipeline, model_dir, features, targets, metrics):
+    joblib.dump(pipeline, model_dir / "lgb_model.pkl")
+    # The schema only needs the column layout, so a slice of the windows will do
+    # as `features`
+    model = get_model_registry().sklearn.create_model(
+        name="citibike_demand_predictor_next_hour",
+        metrics=metrics,
+        input_example=features.sample(),
+        model_schema=get_model_schema(features, targets),
+    )
+    model.save(str(model_dir))
+
+
+model_dir = config.MODELS_DIR / "citibike_demand_predictor"
+model_dir.mkdir(parents=True, exist_ok=True)
+
+# ─────────────────────────────────────────────────────────────
+# Step 0: Warm-start update of the registered model
+# ─────────────────────────────────────────────────────────────
+# Most weeks only add trees to the registered booster on the windows that
+# closed since it was trained, which needs a few weeks of history instead
+# of 180 days. Every FULL_RETRAIN_EVERY updates, or when its error on the
+# new windows drifted, the model is retrained from scratch below instead.
+champion_metrics = load_metrics_from_registry()
+reason = full_retrain_reason(champion_metrics, config.FULL_RETRAIN_EVERY, force=full)
+if reason is None:
+    champion = load_model_from_registry()
+    # fetch_days_data() reads the history ending one year ago
+    fetched_until = datetime.now(timezone.utc) - timedelta(days=365)
+    days = history_days_needed(champion_metrics, fetched_until)
+    print(f"♻️ Updating the registered model on the last {days} days...")
+    recent_data = fetch_days_data(days, columns=["start_station_id", "start_hour", "rides"])
+    recent_data = recent_data.sort_values(["start_station_id", "start_hour"]).reset_index(drop=True)
+
+    updated, report = warm_start_update(
+        champion,
+        champion_metrics,
+        recent_data,
+        config.WARM_START_WINDOWS_DIR,
+        extra_trees=config.WARM_START_TREES,
+        drift_tolerance=config.FULL_RETRAIN_DRIFT,
+        step_size=config.WARM_START_STEP_SIZE,
+    )
+    print(f"♻️ {report}")
+    if not report["drift"]:
+        if updated is not None:
+            print(f"✅ {report['reason'].capitalize()}. Registering...")
+            windows = load_ts_windows_memmap(config.WARM_START_WINDOWS_DIR)
+            features, targets = ts_windows_frame(windows, slice(0, 100))
+            save_lag_columns(model_lags(updated), model_dir / "lag_columns.json")
+            register_model(updated, model_dir, features, targets, report["metrics"])
+        else:
+            print(f"🚫 {report['reason'].capitalize()}. Skipping registration.")
+        print(f"🔐 Hopsworks session: {get_hopsworks_session_stats()}")
+        sys.exit(0)
+    reason = report["reason"]
+
+print(f"🔁 Full retrain: {reason}")
 
 # ─────────────────────────────────────────────────────────────
 # Step 1: Load data from feature store
 # ─────────────────────────────────────────────────────────────
+# Only the raw series is needed; the windows are rebuilt from it below
 print("📥 Fetching CitiBike time-series data from Hopsworks...")
-ts_data = fetch_days_data(180)
+ts_data = fetch_days_data(
+    config.TRAINING_HISTORY_DAYS, columns=["start_station_id", "start_hour", "rides"]
+)
+ts_data = ts_data.sort_values(["start_station_id", "start_hour"]).reset_index(drop=True)
 
 # ─────────────────────────────────────────────────────────────
 # Step 2: Transform to lag-based supervised learning data
 # ─────────────────────────────────────────────────────────────
+# Windows are streamed in batches into memory-mapped files on disk, so a
+# year of history does not have to fit in RAM; only one batch is held at
+# a time and training reads the files in place. Rows are ordered by target
+# hour so every backtest fold is a contiguous slice of the files.
 print("🧪 Transforming time-series data into supervised features/target...")
-features, targets = transform_ts_data_info_features_and_target_bike(
-    ts_data, window_size=24 * 28, step_size=23
+WINDOW_SIZE = 24 * 28
+STEP_SIZE = 23
+MEMORY_BUDGET_MB = 512
+
+write_ts_windows_memmap(
+    ts_data,
+    config.TRAINING_WINDOWS_DIR,
+    window_size=WINDOW_SIZE,
+    step_size=STEP_SIZE,
+    memory_budget_mb=MEMORY_BUDGET_MB,
+    dtype="float32",
+    sort_by_time=True,
 )
+del ts_data
+windows = load_ts_windows_memmap(config.TRAINING_WINDOWS_DIR)
+print(f"💾 {windows['metadata']['n_windows']} windows written to {config.TRAINING_WINDOWS_DIR}")
 
 
 # ─────────────────────────────────────────────────────────────
-# Step 3: Load Best Hyperparameters (from Optuna)
+# Step 3: Build the model input
+# ─────────────────────────────────────────────────────────────
+# The feature steps do not depend on the hyperparameters, so the model
+# input is built once on disk and shared by tuning, backtest and training.
+pipeline = get_pipeline(feature_dtype="float32")
+model_input_path = config.TRAINING_WINDOWS_DIR / "model_input.npy"
+model_input, feature_names = write_model_input(pipeline, windows, model_input_path)
+
+# ─────────────────────────────────────────────────────────────
+# Step 4: Load Best Hyperparameters (from Optuna)
 # ─────────────────────────────────────────────────────────────
 best_parameters = {
     "n_estimators": 709,
@@ -43,44 +153,129 @@ best_parameters = {
 }
 
 # ─────────────────────────────────────────────────────────────
-# Step 4: Train model
+# Step 5: Prune the lag columns
+# ─────────────────────────────────────────────────────────────
+# Only the LAG_TOP_K lags with the highest booster gain on a validation
+# week (plus the four weekly lags of the 4-week average) are kept, and the
+# model input is rebuilt with just those columns for everything below.
+lags = None
+if config.LAG_TOP_K:
+    print(f"✂️ Ranking the {len(feature_names) - 3} lag columns by gain...")
+    lag_gain = rank_lags_by_gain(
+        model_input,
+        windows["targets"],
+        feature_names,
+        windows["start_hours"],
+        best_parameters,
+        holdout_days=config.BACKTEST_TEST_DAYS,
+    )
+    lags = select_lags(lag_gain, config.LAG_TOP_K)
+    print(f"✂️ Keeping {len(lags)} lags: {lags}")
+
+    pipeline = get_pipeline(feature_dtype="float32", lag_columns=[f"rides_t-{lag}" for lag in lags])
+    model_input_path = config.TRAINING_WINDOWS_DIR / "model_input_pruned.npy"
+    model_input, feature_names = write_model_input(pipeline, windows, model_input_path)
+
+# ─────────────────────────────────────────────────────────────
+# Step 6: Tune the hyperparameters (--tune)
+# ─────────────────────────────────────────────────────────────
+if tune:
+    # The parameters above are the first trial, so the search can only
+    # return something at least as good on the validation week
+    print("🔍 Tuning LightGBM hyperparameters with Optuna...")
+    best_parameters, trials = tune_hyperparameters(
+        model_input,
+        windows["targets"],
+        feature_names,
+        windows["start_hours"],
+        config.TUNING_DIR,
+        seed_params=best_parameters,
+        n_trials=config.TUNING_TRIALS,
+        n_workers=config.TUNING_WORKERS,
+        time_budget_s=config.TUNING_TIME_BUDGET_S,
+        holdout_days=config.BACKTEST_TEST_DAYS,
+    )
+    print(trials.to_string(index=False))
+    (config.TUNING_DIR / "best_parameters.json").write_text(json.dumps(best_parameters, indent=2))
+    print(f"🏆 Best hyperparameters: {best_parameters}")
+
+pipeline[-1].set_params(**best_parameters)
+
+# ─────────────────────────────────────────────────────────────
+# Step 7: Walk-forward backtest
 # ─────────────────────────────────────────────────────────────
-print("🎯 Training LightGBM with Optuna best hyperparameters...")
-pipeline = get_pipeline(**best_parameters)
-pipeline.fit(features, targets)
+# Every fold trains on the weeks before its test week and is scored on
+# that unseen week, in parallel.
+print("🧮 Backtesting LightGBM...")
+backtest = run_backtest(
+    config.TRAINING_WINDOWS_DIR,
+    model_input_path,
+    feature_names,
+    best_parameters,
+    n_folds=config.BACKTEST_FOLDS,
+    test_days=config.BACKTEST_TEST_DAYS,
+    n_workers=config.BACKTEST_WORKERS,
+    time_budget_s=config.BACKTEST_TIME_BUDGET_S,
+    champion=load_model_from_registry(),
+)
+print(backtest.to_string(index=False))
 
 # ─────────────────────────────────────────────────────────────
-# Step 5: Evaluate performance
+# Step 8: Evaluate performance
 # ─────────────────────────────────────────────────────────────
-predictions = pipeline.predict(features)
-test_mae = mean_absolute_error(targets, predictions)
+# The newest week is the only one the registered model has not been
+# trained on, so both models are compared on it. Folds cut short (by a
+# gap in the data or by the time budget) are left out, and without a
+# complete newest fold the registered model is kept.
+complete = backtest[backtest["complete"]]
+test_mae = complete["mae"].mean()
+latest_fold = backtest.iloc[-1]
 
-print(f"📉 New model MAE: {test_mae:.4f}")
-metric = load_metrics_from_registry()
-print(f"📈 Previous model MAE: {metric['test_mae']:.4f}")
+print(f"📉 New model backtest MAE over {len(complete)} complete folds: {test_mae:.4f}")
+print(f"📉 New model MAE on the latest week: {latest_fold['mae']:.4f}")
+print(f"📈 Registered model MAE on the latest week: {latest_fold['champion_mae']:.4f}")
 
 # ─────────────────────────────────────────────────────────────
-# Step 6: Register if improved
+# Step 9: Train on all windows and register if improved
 # ─────────────────────────────────────────────────────────────
-if test_mae < metric.get("test_mae"):
-    print("✅ New model outperforms previous. Registering...")
+if not latest_fold["complete"]:
+    reason = latest_fold["status"] if latest_fold["status"] != "ok" else "short test range"
+    print(f"🚫 Latest backtest fold is incomplete ({reason}). Skipping registration.")
+elif latest_fold["mae"] < latest_fold["champion_mae"]:
+    print("✅ New model outperforms previous. Training on all windows and registering...")
+    # Last week's binned Dataset is kept in the Hopsworks dataset storage;
+    # most of its rows and its bins carry over to this week's training set
+    dataset_api = get_hopsworks_project().get_dataset_api()
+    dataset_cache = DatasetCache(config.DATASET_CACHE_DIR)
+    remote_cache_dir = "Resources/citibike/dataset_cache"
+    config.DATASET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for path in dataset_cache.files():
+        if not path.exists() and dataset_api.exists(f"{remote_cache_dir}/{path.name}"):
+            dataset_api.download(f"{remote_cache_dir}/{path.name}", local_path=str(path), overwrite=True)
 
-    model_path = config.MODELS_DIR / "lgb_model.pkl"
-    joblib.dump(pipeline, model_path)
+    dataset = dataset_cache.get(model_input, windows["targets"], feature_names, windows["start_hours"])
+    print(f"🗃️ Binned training Dataset: {dataset_cache.last_status}")
+    pipeline.steps[-1] = ("boosterregressor", BoosterRegressor(best_parameters).fit(dataset))
 
-    input_schema = Schema(features)
-    output_schema = Schema(targets)
-    model_schema = ModelSchema(input_schema=input_schema, output_schema=output_schema)
+    if dataset_cache.last_status != "hit":
+        for path in dataset_cache.files():
+            dataset_api.upload(str(path), remote_cache_dir, overwrite=True)
 
-    project = get_hopsworks_project()
-    model_registry = project.get_model_registry()
+    # The pruned lag list is saved next to the model so consumers can build
+    # only those columns without unpickling it
+    if lags is not None:
+        save_lag_columns(lags, model_dir / "lag_columns.json")
 
-    model = model_registry.sklearn.create_model(
-        name="citibike_demand_predictor_next_hour",
-        metrics={"test_mae": test_mae},
-        input_example=features.sample(),
-        model_schema=model_schema,
-    )
-    model.save(str(model_path))
+    features, targets = ts_windows_frame(windows, slice(0, 100))
+    metrics = {
+        "test_mae": test_mae,
+        "latest_week_mae": latest_fold["mae"],
+        # Starts the warm-start updates of the following weeks
+        "incremental_updates": 0,
+        "trained_until": pd.Timestamp(windows["start_hours"][-1]).timestamp(),
+    }
+    register_model(pipeline, model_dir, features, targets, metrics)
 else:
     print("🚫 New model did not beat previous MAE. Skipping registration.")
+
+print(f"🔐 Hopsworks session: {get_hopsworks_session_stats()}")
@@ -0,0 +1,177 @@
+"""
+backtest.py – parallel walk-forward backtesting on memory-mapped windows.
+
+The windows are written once with `write_ts_windows_memmap(...,
+sort_by_time=True)` and the model input once with `write_model_input()`.
+Because the rows are ordered by target hour, every fold is a pair of
+contiguous row ranges of those files:
+
+    fold k:  train = rows whose target hour is before test_start_k
+             test  = rows whose target hour is in [test_start_k, test_stop_k)
+
+Folds are therefore slices of the memory maps rather than copies, and the
+worker processes open the files themselves instead of receiving the data.
+Test weeks are consecutive and the newest one ends at the last target hour.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+
+from src.data_utils import load_ts_windows_memmap, ts_windows_frame
+
+
+def walk_forward_folds(
+    start_hours, n_folds: int = 4, test_days: int = 7, min_train_days: int = 28, step_hours: int = 1
+) -> List[Dict]:
+    """
+    Row ranges of `n_folds` expanding-window folds over the time-sorted
+    `start_hours`, oldest first. Folds with less than `min_train_days` of
+    training history are dropped.
+
+    `full_range` tells whether a fold's rows span its whole test range, i.e.
+    its first and last hours are within `step_hours` (the spacing of the
+    windows) of the range bounds; a gap in the data can cut a fold short.
+    """
+    hours = np.asarray(start_hours, dtype="datetime64[ns]")
+    if len(hours) == 0:
+        return []
+    test_length = np.timedelta64(test_days * 24, "h")
+    step = np.timedelta64(step_hours, "h")
+    end = hours[-1] + np.timedelta64(1, "h")
+
+    folds = []
+    for k in range(n_folds):
+        test_stop_hour = end - (n_folds - 1 - k) * test_length
+        test_start_hour = test_stop_hour - test_length
+        if test_start_hour - hours[0] < np.timedelta64(min_train_days * 24, "h"):
+            continue
+        test_start, test_stop = np.searchsorted(hours, [test_start_hour, test_stop_hour])
+        if test_start == test_stop:
+            continue
+        folds.append(
+            {
+                "fold": k,
+                "train_stop": int(test_start),
+                "test_start": int(test_start),
+                "test_stop": int(test_stop),
+                "test_start_hour": pd.Timestamp(test_start_hour),
+                "test_stop_hour": pd.Timestamp(test_stop_hour),
+                "full_range": bool(
+                    hours[test_start] < test_start_hour + step and hours[test_stop - 1] >= test_stop_hour - step
+                ),
+            }
+        )
+    return folds
+
+
+def _deadline_callback(deadline: float):
+    # Stops boosting once the backtest's time budget is spent
+    def _callback(env):
+        if time.time() >= deadline:
+            raise lgb.callback.EarlyStopException(env.iteration, env.evaluation_result_list or [])
+
+    _callback.order = 40
+    return _callback
+
+
+def _run_fold(windows_dir, model_input_path, feature_names, fold, params, deadline) -> Dict:
+    result = dict(fold, train_rows=fold["train_stop"], test_rows=fold["test_stop"] - fold["test_start"])
+    if time.time() >= deadline:
+        return dict(result, status="skipped")
+
+    model_input = np.load(model_input_path, mmap_mode="r")
+    targets = np.load(Path(windows_dir) / "targets.npy", mmap_mode="r")
+    train = slice(0, fold["train_stop"])
+    test = slice(fold["test_start"], fold["test_stop"])
+
+    start = time.perf_counter()
+    regressor = lgb.LGBMRegressor(**params)
+    regressor.fit(
+        model_input[train],
+        targets[train],
+        feature_name=feature_names,
+        callbacks=[_deadline_callback(deadline)],
+    )
+    fit_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = regressor.predict(model_input[test])
+    predict_s = time.perf_counter() - start
+
+    n_trees = regressor.booster_.current_iteration()
+    return dict(
+        result,
+        status="ok" if n_trees >= params.get("n_estimators", 100) else "truncated",
+        trees=n_trees,
+        mae=mean_absolute_error(targets[test], predictions),
+        fit_s=fit_s,
+        predict_s=predict_s,
+    )
+
+
+def run_backtest(
+    windows_dir,
+    model_input_path,
+    feature_names,
+    params: Dict,
+    n_folds: int = 4,
+    test_days: int = 7,
+    min_train_days: int = 28,
+    n_workers: Optional[int] = None,
+    time_budget_s: Optional[float] = None,
+    champion=None,
+) -> pd.DataFrame:
+    """
+    Trains and scores LGBMRegressor(**params) on every walk-forward fold of
+    the windows in `windows_dir`, in parallel worker processes.
+
+    Returns one row per fold with its row ranges, held-out `mae`, number of
+    trees and fit/predict times. Folds are started newest first. Once
+    `time_budget_s` is spent, boosting stops early (status "truncated")
+    and folds that have not started are skipped. With `champion` (any
+    model with a `predict(features)` method, e.g. the registered
+    pipeline) its MAE on each test range is added as `champion_mae`.
+
+    `complete` marks the folds whose rows span their whole test range and
+    whose model was boosted to the end (status "ok"); only those are a
+    fair basis for comparing models.
+    """
+    windows = load_ts_windows_memmap(windows_dir)
+    if not windows["metadata"].get("sorted_by_time"):
+        raise ValueError("Backtesting needs windows written with sort_by_time=True.")
+
+    folds = walk_forward_folds(
+        windows["start_hours"], n_folds, test_days, min_train_days, windows["metadata"].get("step_size", 1)
+    )
+    if not folds:
+        raise ValueError("Not enough history for a single backtest fold.")
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(folds))
+    # Split the cores between the folds instead of oversubscribing them
+    params = {"n_jobs": max(1, (os.cpu_count() or 1) // n_workers), "verbose": -1, **params}
+    deadline = time.time() + time_budget_s if time_budget_s is not None else float("inf")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(_run_fold, windows_dir, model_input_path, feature_names, fold, params, deadline)
+            for fold in folds[::-1]
+        ]
+        report = pd.DataFrame([future.result() for future in futures[::-1]])
+    report["complete"] = report["full_range"] & (report["status"] == "ok")
+
+    if champion is not None:
+        champion_mae = []
+        for fold in folds:
+            features, targets = ts_windows_frame(windows, slice(fold["test_start"], fold["test_stop"]))
+            champion_mae.append(mean_absolute_error(targets, champion.predict(features)))
+        report["champion_mae"] = champion_mae
+
+    return report
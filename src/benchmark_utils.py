@@ -0,0 +1,252 @@
+"""
+Micro-benchmarks for the CitiBike data and feature transforms.
+
+Run them all with:
+```
+python -m src.benchmark_utils
+```
+Every benchmark works on synthetic data, so no Hopsworks access is needed.
+"""
+
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+from src.data_utils import _station_partitions, transform_ts_data_info_features_and_target_bike
+from src.feature_utils import add_lag_features
+from src.inference import get_model_predictions
+from src.pipeline_utils import TemporalFeatureEngineer, export_lean_predictor, get_pipeline
+
+
+def _synthetic_hourly_rides(n_stations, n_hours, seed=42):
+    """Hourly ride counts for `n_stations` stations, station-major order."""
+    rng = np.random.default_rng(seed)
+    station_ids = np.array([f"{5000 + i}.{i % 100:02d}" for i in range(n_stations)], dtype=object)
+    hours = pd.date_range("2023-12-01", periods=n_hours, freq="h")
+    return pd.DataFrame(
+        {
+            "start_station_id": np.repeat(station_ids, n_hours),
+            "start_hour": np.tile(hours.values, n_stations),
+            "rides": rng.poisson(3, n_stations * n_hours).astype(np.int64),
+        }
+    )
+
+
+def _timed(func, *args, repeat=3, **kwargs):
+    """Best wall time over `repeat` runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _timed_with_peak_memory(func, *args, **kwargs):
+    """Wall time in seconds and peak traced allocation in MiB of one run."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024**2
+
+
+def _partition_by_mask(df):
+    # The original approach: one boolean scan of the full frame per station
+    return [df[df["start_station_id"] == location_id] for location_id in df["start_station_id"].unique()]
+
+
+def benchmark_station_partitioning(
+    station_counts=(100, 500, 1000, 2000, 5000), n_hours=48, baseline_max_stations=1000
+):
+    """
+    Times splitting the frame into stations with the group index used by the
+    window builders against the per-station boolean mask it replaced.
+
+    The mask baseline is quadratic, so it is only run up to
+    `baseline_max_stations` stations.
+    """
+    results = []
+    for n_stations in station_counts:
+        df = _synthetic_hourly_rides(n_stations, n_hours).sample(frac=1, random_state=0)
+        group_index_s = _timed(_station_partitions, df["start_station_id"].to_numpy())
+        mask_scan_s = (
+            _timed(_partition_by_mask, df, repeat=1)
+            if n_stations <= baseline_max_stations
+            else np.nan
+        )
+        results.append(
+            {
+                "stations": n_stations,
+                "rows": len(df),
+                "group_index_s": group_index_s,
+                "mask_scan_s": mask_scan_s,
+            }
+        )
+    return pd.DataFrame(results)
+
+
+def _lag_features_by_shift(df, lags=range(1, 673)):
+    # The original approach: one groupby/shift and one column insert per lag
+    df = df.copy()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+        for lag in lags:
+            df[f"lag_{lag}"] = df.groupby("start_station_id")["rides"].shift(lag)
+    return df.copy()
+
+
+def benchmark_lag_features(n_stations=200, n_hours=28 * 24, lags=range(1, 673)):
+    """
+    Wall time and peak memory of building the lag_1..lag_672 block with
+    add_lag_features() against the per-lag groupby/shift loop (including
+    the defragmenting copy it needed).
+    """
+    df = _synthetic_hourly_rides(n_stations, n_hours)
+    results = []
+    for name, func in [("groupby_shift", _lag_features_by_shift), ("block", add_lag_features)]:
+        elapsed, peak_mib = _timed_with_peak_memory(func, df, lags=lags)
+        results.append(
+            {"method": name, "rows": len(df), "lags": len(lags), "time_s": elapsed, "peak_mib": peak_mib}
+        )
+    return pd.DataFrame(results)
+
+
+def _fitted_pipeline(n_stations=50, n_hours=24 * 35, feature_dtype=None, **hyper_params):
+    """A small get_pipeline() model fitted on synthetic windows, and its training features."""
+    df = _synthetic_hourly_rides(n_stations, n_hours)
+    features, targets = transform_ts_data_info_features_and_target_bike(
+        df, window_size=24 * 28, step_size=23, dtype=feature_dtype
+    )
+    params = {"n_estimators": 100, "num_leaves": 63, "verbose": -1, **hyper_params}
+    pipeline = get_pipeline(feature_dtype=feature_dtype, **params)
+    pipeline.fit(features.copy(), targets)
+    return pipeline, features
+
+
+def benchmark_lean_predictor(batch_sizes=(1, 100, 2000), repeat=5):
+    """
+    Predict latency of a fitted get_pipeline() pipeline against the
+    LeanPredictor exported from it, and whether their outputs are identical.
+    """
+    pipeline, features = _fitted_pipeline()
+    lean_predictor = export_lean_predictor(pipeline)
+    results = []
+    for batch_size in batch_sizes:
+        batch = features.sample(batch_size, replace=True, random_state=0).reset_index(drop=True)
+        # The pipeline adds a column to its input, so give every run a fresh copy
+        pipeline_s = _timed(lambda: pipeline.predict(batch.copy()), repeat=repeat)
+        lean_s = _timed(lean_predictor.predict, batch, repeat=repeat)
+        results.append(
+            {
+                "rows": batch_size,
+                "pipeline_ms": pipeline_s * 1e3,
+                "lean_ms": lean_s * 1e3,
+                "speedup": pipeline_s / lean_s,
+                "identical": np.array_equal(pipeline.predict(batch.copy()), lean_predictor.predict(batch)),
+            }
+        )
+    return pd.DataFrame(results)
+
+
+def _average_in_place(X, dtype=None):
+    # The original approach: the average is written into the caller's frame
+    average = X[[f"rides_t-{7*24}", f"rides_t-{14*24}", f"rides_t-{21*24}", f"rides_t-{28*24}"]].mean(axis=1)
+    X["average_rides_last_4_weeks"] = average if dtype is None else average.astype(dtype)
+    return X
+
+
+class _TemporalFeaturesByCopy(TemporalFeatureEngineer):
+    # The original approach: the whole frame is copied, then copied again by drop()
+    def transform(self, X, y=None):
+        X_ = X.copy()
+        X_["hour"] = X_["start_hour"].dt.hour
+        X_["day_of_week"] = X_["start_hour"].dt.dayofweek
+        if self.dtype is not None:
+            X_[["hour", "day_of_week"]] = X_[["hour", "day_of_week"]].astype(self.dtype)
+        return X_.drop(columns=["start_hour", "start_station_id"])
+
+
+def benchmark_pipeline_allocations(batch_sizes=(1, 100, 2000), feature_dtype="float32"):
+    """
+    Peak memory traced by tracemalloc (Python and NumPy allocations; the
+    LightGBM C++ side is not traced) and wall time of one pipeline predict
+    call with the view-passing feature steps of get_pipeline() against the
+    copying steps they replaced, on the same fitted regressor.
+    """
+    pipeline, features = _fitted_pipeline(feature_dtype=feature_dtype)
+    copying_pipeline = make_pipeline(
+        FunctionTransformer(_average_in_place, validate=False, kw_args={"dtype": feature_dtype}),
+        _TemporalFeaturesByCopy(dtype=feature_dtype),
+        pipeline[-1],
+    )
+    results = []
+    for batch_size in batch_sizes:
+        batch = features.sample(batch_size, replace=True, random_state=0).reset_index(drop=True)
+        for name, model in [("copying", copying_pipeline), ("views", pipeline)]:
+            # The copying steps modify their input, so every run gets its own batch
+            model_batch = batch.copy()
+            elapsed, peak_mib = _timed_with_peak_memory(model.predict, model_batch)
+            results.append({"rows": batch_size, "steps": name, "time_s": elapsed, "peak_mib": peak_mib})
+    return pd.DataFrame(results)
+
+
+def _synthetic_latest_windows(n_stations, window_size=24 * 28, seed=42):
+    """One float32 inference window per station, as built for the next hour."""
+    rng = np.random.default_rng(seed)
+    lags = rng.poisson(3, (n_stations, window_size)).astype(np.float32)
+    features = pd.DataFrame(
+        lags, columns=[f"rides_t-{window_size - i}" for i in range(window_size)], copy=False
+    )
+    features["start_station_id"] = [f"{5000 + i}.{i % 100:02d}" for i in range(n_stations)]
+    features["start_hour"] = pd.Timestamp("2024-01-01 12:00")
+    return features
+
+
+def benchmark_sharded_inference(station_counts=(2000, 20000), worker_counts=(1, 2, 4)):
+    """
+    Throughput (stations per second) of get_model_predictions() with the
+    model running in 1, 2, ... worker processes, including pool start-up.
+    """
+    pipeline, _ = _fitted_pipeline(feature_dtype="float32")
+    model = export_lean_predictor(pipeline)
+    results = []
+    for n_stations in station_counts:
+        features = _synthetic_latest_windows(n_stations)
+        for n_workers in worker_counts:
+            elapsed = _timed(get_model_predictions, model, features, n_workers=n_workers, repeat=1)
+            results.append(
+                {
+                    "stations": n_stations,
+                    "workers": n_workers,
+                    "time_s": elapsed,
+                    "stations_per_s": n_stations / elapsed,
+                }
+            )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    pd.set_option("display.width", 120)
+
+    print("Station partitioning")
+    print(benchmark_station_partitioning().to_string(index=False))
+
+    print("\nLag feature block")
+    print(benchmark_lag_features().to_string(index=False))
+
+    print("\nLean predictor vs. pipeline")
+    print(benchmark_lean_predictor().to_string(index=False))
+
+    print("\nPipeline predict allocations")
+    print(benchmark_pipeline_allocations().to_string(index=False))
+
+    print("\nSharded batch inference")
+    print(benchmark_sharded_inference().to_string(index=False))
@@ -11,7 +11,20 @@ DATA_DIR = PARENT_DIR / "data"
 RAW_DATA_DIR = DATA_DIR / "raw"
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
 TRANSFORMED_DATA_DIR = DATA_DIR / "transformed"
+# Materialized station x hour ride counts; a local cache that only carries
+# over between runs on a host that keeps this directory
+HOURLY_COUNTS_DIR = PROCESSED_DATA_DIR / "hourly_counts"
+FEATURE_STATE_PATH = PROCESSED_DATA_DIR / "feature_state.parquet"
 MODELS_DIR = PARENT_DIR / "models"
+MODEL_CACHE_DIR = MODELS_DIR / "cache"
+# Memory-mapped training windows written by the training pipeline
+TRAINING_WINDOWS_DIR = TRANSFORMED_DATA_DIR / "training_windows"
+# Binned LightGBM training Dataset reused by the next retrain
+DATASET_CACHE_DIR = TRANSFORMED_DATA_DIR / "dataset_cache"
+# Windows of the newest hours used by warm-start retraining
+WARM_START_WINDOWS_DIR = TRANSFORMED_DATA_DIR / "warm_start_windows"
+# Multi-horizon training windows written by the forecast training pipeline
+FORECAST_WINDOWS_DIR = TRANSFORMED_DATA_DIR / "forecast_windows"
 
 # Create directories if they don't exist
 for directory in [
@@ -27,6 +40,11 @@ for directory in [
 HOPSWORKS_API_KEY = os.getenv("HOPSWORKS_API_KEY")
 HOPSWORKS_PROJECT_NAME = os.getenv("HOPSWORKS_PROJECT_NAME")
 
+# "hopsworks" or "local"; the local backend keeps feature groups, feature
+# views, models and datasets as files under LOCAL_FEATURE_STORE_DIR
+FEATURE_STORE_BACKEND = os.getenv("FEATURE_STORE_BACKEND", "hopsworks")
+LOCAL_FEATURE_STORE_DIR = Path(os.getenv("LOCAL_FEATURE_STORE_DIR", DATA_DIR / "local_store"))
+
 FEATURE_GROUP_NAME = "bike_hourly_fg"
 FEATURE_GROUP_VERSION = 1
 
@@ -37,4 +55,53 @@ FEATURE_VIEW_VERSION = 1
 MODEL_NAME = "citibike_demand_predictor_next_hour"
 MODEL_VERSION = 1
 
+# Days of hourly history the training pipeline builds windows from
+TRAINING_HISTORY_DAYS = int(os.getenv("TRAINING_HISTORY_DAYS", "180"))
+
+# Walk-forward backtest of the training pipeline: number of weekly test
+# folds, worker processes (0 = one per core, at most one per fold) and
+# the wall-clock budget of the whole backtest
+BACKTEST_FOLDS = int(os.getenv("BACKTEST_FOLDS", "4"))
+BACKTEST_TEST_DAYS = int(os.getenv("BACKTEST_TEST_DAYS", "7"))
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", "0")) or None
+BACKTEST_TIME_BUDGET_S = float(os.getenv("BACKTEST_TIME_BUDGET_S", "7200"))
+
+# Lags kept by the training pipeline's gain-based lag pruning, on top of
+# the four weekly lags of the 4-week average (0 keeps all 672)
+LAG_TOP_K = int(os.getenv("LAG_TOP_K", "64"))
+
+# Lags the feature pipeline stores in the feature group, as a comma
+# separated list of hours (unset stores lag_1..lag_672). The feature group
+# schema is fixed per version, so changing it needs a new
+# FEATURE_GROUP_VERSION.
+FEATURE_GROUP_LAGS = [int(lag) for lag in os.getenv("FEATURE_GROUP_LAGS", "").split(",") if lag.strip()] or None
+
+# Warm-start retraining: the weekly run adds WARM_START_TREES trees to the
+# registered booster on the newest windows, and only retrains from scratch
+# every FULL_RETRAIN_EVERY runs, when the registered model's MAE on the new
+# windows drifted more than FULL_RETRAIN_DRIFT above its test MAE, or when
+# run with --full
+FULL_RETRAIN_EVERY = int(os.getenv("FULL_RETRAIN_EVERY", "4"))
+FULL_RETRAIN_DRIFT = float(os.getenv("FULL_RETRAIN_DRIFT", "0.15"))
+WARM_START_TREES = int(os.getenv("WARM_START_TREES", "100"))
+WARM_START_STEP_SIZE = int(os.getenv("WARM_START_STEP_SIZE", "1"))
+
+# Hyperparameter search of the training pipeline (run with --tune)
+TUNING_DIR = MODELS_DIR / "tuning"
+TUNING_TRIALS = int(os.getenv("TUNING_TRIALS", "50"))
+TUNING_WORKERS = int(os.getenv("TUNING_WORKERS", "0")) or None
+TUNING_TIME_BUDGET_S = float(os.getenv("TUNING_TIME_BUDGET_S", "3600"))
+
+# Worker processes and shard size for get_model_predictions(); 1 worker
+# predicts in-process
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_CHUNK_SIZE = int(os.getenv("INFERENCE_CHUNK_SIZE", "0")) or None
+
 FEATURE_GROUP_MODEL_PREDICTION = "bike_demand_predictions"
+
+# Multi-horizon forecaster: one direct booster per hour ahead, predicting
+# the next FORECAST_HORIZON hours in one inference run (--multi-horizon)
+FORECAST_HORIZON = int(os.getenv("FORECAST_HORIZON", "24"))
+FORECAST_MODEL_NAME = "citibike_demand_forecaster"
+FEATURE_GROUP_MODEL_FORECAST = "bike_demand_forecasts"
+PREDICTION_CACHE_DIR = DATA_DIR / "prediction_cache"
@@ -1,79 +1,464 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _sliding_windows(values, window_size, step_size=1, horizon=1):
+    """
+    Returns a read-only strided view with one row per window of
+    `window_size + horizon` consecutive values (features followed by the
+    `horizon` targets), keeping every `step_size`-th window. No data is
+    copied.
+    """
+    if len(values) < window_size + horizon:
+        raise ValueError("Not enough data to create even one window.")
+
+    # The last values can only ever be targets, never the start of a window,
+    # which matches range(0, len(values) - window_size - horizon + 1, step_size).
+    return sliding_window_view(values, window_size + horizon)[::step_size]
+
+
+def _station_partitions(station_ids):
+    """
+    Groups rows by station in a single pass.
+
+    Returns the row order that lays every station's rows out contiguously
+    (keeping their original relative order), the station ids in order of
+    first appearance and the offsets delimiting each station in that order,
+    so station `k` occupies `order[offsets[k]:offsets[k + 1]]`. Rows with a
+    missing station id are moved to a trailing group that is not listed.
+    """
+    codes, uniques = pd.factorize(station_ids, sort=False)
+    codes[codes < 0] = len(uniques)
+    # A stable sort on small integer keys is a linear-time radix sort
+    if len(uniques) < np.iinfo(np.uint16).max:
+        codes = codes.astype(np.uint16)
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(len(uniques) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(uniques) + 1), out=offsets[1:])
+    return order, uniques, offsets
+
+
+def _build_station_windows(df, feature_col, window_size, step_size, horizon=1):
+    """
+    Builds the windows of every station with bulk array operations.
+
+    Returns the stacked windows (features + targets), the station id and the
+    (first) target hour of every window, in the order stations first appear
+    in `df`.
+    """
+    order, location_ids, offsets = _station_partitions(df["start_station_id"].to_numpy())
+    all_values = df[feature_col].to_numpy()[order]
+    all_times = df["start_hour"].to_numpy()[order]
+    windows, station_ids, target_times = [], [], []
+
+    for k, location_id in enumerate(location_ids):
+        try:
+            values = all_values[offsets[k] : offsets[k + 1]]
+            times = all_times[offsets[k] : offsets[k + 1]]
+
+            station_windows = _sliding_windows(values, window_size, step_size, horizon)
+            n_windows = len(station_windows)
+
+            windows.append(station_windows)
+            station_ids.append(np.repeat(location_ids[k : k + 1], n_windows))
+            target_times.append(times[window_size::step_size][:n_windows])
+
+        except ValueError as e:
+            print(f"Skipping start_station_id {location_id}: {str(e)}")
+
+    if not windows:
+        raise ValueError("No data could be transformed.")
+
+    return (
+        np.concatenate(windows),
+        np.concatenate(station_ids),
+        np.concatenate(target_times),
+    )
+
+
+def _lag_positions(window_size, lags):
+    """
+    Positions in a window of the `lags` (hours before the target) to keep,
+    oldest first, or None to keep all `window_size` of them.
+    """
+    if lags is None:
+        return None
+    lags = np.sort(np.unique(np.asarray(lags, dtype=np.int64)))[::-1]
+    if len(lags) == 0:
+        raise ValueError("At least one lag is needed.")
+    if lags[-1] < 1 or lags[0] > window_size:
+        raise ValueError(f"Lags must be between 1 and the window size ({window_size}).")
+    return window_size - lags
+
+
+def _feature_columns(feature_col, window_size, lags=None):
+    positions = range(window_size) if lags is None else _lag_positions(window_size, lags)
+    return [f"{feature_col}_t-{window_size - i}" for i in positions]
+
+
+def _target_columns(horizon):
+    return [f"target_t+{h}" for h in range(1, horizon + 1)]
+
+
+def _targets_to_frame(targets):
+    """The `target` Series of 1-D `targets`, one column per horizon otherwise."""
+    if targets.ndim == 1:
+        return pd.Series(targets, name="target")
+    return pd.DataFrame(targets, columns=_target_columns(targets.shape[1]), copy=False)
+
+
+def _windows_to_frame(windows, station_ids, feature_col, window_size, dtype, lags=None):
+    """
+    Wraps the lag part of `windows` in a DataFrame, only the `lags` columns
+    when given.
+
+    With `dtype` set (e.g. "float32" or "uint16") the lags are stored as a
+    single contiguous block of that dtype, the station id as a categorical
+    so nothing is ever upcast to object.
+    """
+    feature_columns = _feature_columns(feature_col, window_size, lags)
+    positions = _lag_positions(window_size, lags)
+    lag_values = windows[:, :window_size] if positions is None else windows[:, positions]
+    if dtype is None:
+        return pd.DataFrame(lag_values, columns=feature_columns), station_ids
+
+    lag_values = np.ascontiguousarray(lag_values, dtype=dtype)
+    features = pd.DataFrame(lag_values, columns=feature_columns, copy=False)
+    return features, pd.Categorical(station_ids)
+
+
 def transform_ts_data_info_features_and_target_bike(
-    df, feature_col="rides", window_size=12, step_size=1
+    df, feature_col="rides", window_size=12, step_size=1, dtype=None, lags=None, horizon=1
 ):
     """
     CitiBike version of transform_ts_data_info_features_and_target().
     Uses 'start_hour' and 'start_station_id' instead of taxi columns.
+
+    Pass `dtype="float32"` (or "uint16") to get a compact, typed lag matrix
+    instead of columns in the dtype of `feature_col`, and `lags` (hours
+    before the target, e.g. a model's pruned lag list) to build only those
+    lag columns. With `horizon` > 1 the targets are a DataFrame of the
+    `horizon` hours from `start_hour` on (`target_t+1`, `target_t+2`, ...)
+    instead of the `target` Series.
     """
-    location_ids = df["start_station_id"].unique()
-    transformed_data = []
+    windows, station_ids, target_times = _build_station_windows(
+        df, feature_col, window_size, step_size, horizon
+    )
 
-    for location_id in location_ids:
-        try:
-            location_data = df[df["start_station_id"] == location_id].reset_index(drop=True)
-            values = location_data[feature_col].values
-            times = location_data["start_hour"].values
+    features, station_ids = _windows_to_frame(
+        windows, station_ids, feature_col, window_size, dtype, lags
+    )
+    features["start_hour"] = target_times
+    features["start_station_id"] = station_ids
+    targets = windows[:, window_size] if horizon == 1 else windows[:, window_size:]
+    if dtype is not None:
+        targets = targets.astype(dtype)
+    return features, _targets_to_frame(targets)
 
-            if len(values) <= window_size:
-                raise ValueError("Not enough data to create even one window.")
 
-            rows = []
-            for i in range(0, len(values) - window_size, step_size):
-                features = values[i : i + window_size]
-                target = values[i + window_size]
-                target_time = times[i + window_size]
-                row = np.append(features, [target, location_id, target_time])
-                rows.append(row)
+def transform_ts_data_info_features_bike(
+    df, feature_col="rides", window_size=12, step_size=1, dtype=None, lags=None
+):
+    windows, station_ids, target_times = _build_station_windows(
+        df, feature_col, window_size, step_size
+    )
 
-            feature_columns = [f"{feature_col}_t-{window_size - i}" for i in range(window_size)]
-            all_columns = feature_columns + ["target", "start_station_id", "start_hour"]
-            transformed_df = pd.DataFrame(rows, columns=all_columns)
+    features, station_ids = _windows_to_frame(
+        windows, station_ids, feature_col, window_size, dtype, lags
+    )
+    features["start_station_id"] = station_ids
+    features["start_hour"] = target_times
+    return features
 
-            transformed_data.append(transformed_df)
 
-        except ValueError as e:
-            print(f"Skipping start_station_id {location_id}: {str(e)}")
+def transform_ts_data_latest_window_bike(df, feature_col="rides", window_size=12, dtype=None, lags=None):
+    """
+    Builds exactly one window per station from the last `window_size` hours
+    of its series, for predicting the hour right after it.
 
-    if not transformed_data:
+    `df` must be sorted by hour within each station. The returned
+    `start_hour` is the hour being predicted (the last hour + 1h), matching
+    the target hour of the training windows. Only the tail of each series
+    is gathered, so the cost is O(stations x window_size) however much
+    history `df` holds; with `lags` only those lag columns are gathered.
+    """
+    order, location_ids, offsets = _station_partitions(df["start_station_id"].to_numpy())
+    sizes = np.diff(offsets[:-1])
+    has_window = sizes >= window_size
+    for location_id in location_ids[~has_window]:
+        print(f"Skipping start_station_id {location_id}: Not enough data to create even one window.")
+    if not has_window.any():
         raise ValueError("No data could be transformed.")
 
-    final_df = pd.concat(transformed_data, ignore_index=True)
-    features = final_df[feature_columns + ["start_hour", "start_station_id"]]
-    targets = final_df["target"]
-    return features, targets
+    # Row positions (in `df`) of the last `window_size` hours of each station
+    ends = offsets[1:-1][has_window]
+    tail_rows = order[ends[:, None] - window_size + np.arange(window_size)]
 
+    last_hours = df["start_hour"].iloc[tail_rows[:, -1]].reset_index(drop=True)
+    positions = _lag_positions(window_size, lags)
+    if positions is not None:
+        tail_rows = tail_rows[:, positions]
 
-def transform_ts_data_info_features_bike(
-    df, feature_col="rides", window_size=12, step_size=1
+    values = df[feature_col].to_numpy()
+    lag_values = values[tail_rows] if dtype is None else values[tail_rows].astype(dtype)
+
+    features = pd.DataFrame(lag_values, columns=_feature_columns(feature_col, window_size, lags), copy=False)
+    station_ids = np.asarray(location_ids)[has_window]
+    features["start_station_id"] = station_ids if dtype is None else pd.Categorical(station_ids)
+    features["start_hour"] = last_hours + pd.Timedelta(hours=1)
+    return features
+
+
+def count_ts_windows_bike(df, window_size=12, step_size=1, horizon=1):
+    """
+    Number of windows the CitiBike window builders produce for `df`,
+    computed from the station sizes alone without building any window.
+    """
+    _, _, offsets = _station_partitions(df["start_station_id"].to_numpy())
+    sizes = np.diff(offsets[:-1])
+    sizes = sizes[sizes >= window_size + horizon]
+    return int(np.sum((sizes - window_size - horizon + step_size) // step_size))
+
+
+def _batch_size_for_budget(memory_budget_mb, window_size, itemsize, horizon=1):
+    # Lags + targets in `dtype`, plus the int64 hour and the station id pointer
+    bytes_per_row = (window_size + horizon) * itemsize + 16
+    return max(1, int(memory_budget_mb * 1024**2) // bytes_per_row)
+
+
+def iter_ts_windows_and_targets_bike(
+    df,
+    feature_col="rides",
+    window_size=12,
+    step_size=1,
+    batch_size=None,
+    memory_budget_mb=256,
+    dtype="float32",
+    lags=None,
+    horizon=1,
 ):
-    location_ids = df["start_station_id"].unique()
-    transformed_data = []
+    """
+    Streaming version of transform_ts_data_info_features_and_target_bike().
 
-    for location_id in location_ids:
-        try:
-            location_data = df[df["start_station_id"] == location_id].reset_index(drop=True)
-            values = location_data[feature_col].values
-            times = location_data["start_hour"].values
+    Yields `(features, targets)` batches of at most `batch_size` windows,
+    filled across station boundaries, in the same row order as the eager
+    builder. When `batch_size` is not given it is derived from
+    `memory_budget_mb`, the size one batch may take in memory. Only one batch
+    is held at a time, so the full window matrix is never materialized.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    if batch_size is None:
+        batch_size = _batch_size_for_budget(memory_budget_mb, window_size, itemsize, horizon)
+
+    order, location_ids, offsets = _station_partitions(df["start_station_id"].to_numpy())
+    all_values = df[feature_col].to_numpy()[order]
+    all_times = df["start_hour"].to_numpy()[order]
+    feature_columns = _feature_columns(feature_col, window_size, lags)
+    positions = _lag_positions(window_size, lags)
 
-            if len(values) <= window_size:
-                raise ValueError("Not enough data to create even one window.")
+    def new_batch():
+        return (
+            np.empty((batch_size, window_size + horizon), dtype=dtype),
+            np.empty(batch_size, dtype=object),
+            np.empty(batch_size, dtype=all_times.dtype),
+        )
 
-            rows = []
-            for i in range(0, len(values) - window_size, step_size):
-                features = values[i : i + window_size]
-                target_time = times[i + window_size]
-                row = np.append(features, [location_id, target_time])
-                rows.append(row)
+    def to_frame(windows, station_ids, target_times, n_rows):
+        lag_values = windows[:n_rows, :window_size] if positions is None else windows[:n_rows, positions]
+        features = pd.DataFrame(lag_values, columns=feature_columns, copy=False)
+        features["start_hour"] = target_times[:n_rows]
+        features["start_station_id"] = pd.Categorical(station_ids[:n_rows])
+        targets = windows[:n_rows, window_size] if horizon == 1 else windows[:n_rows, window_size:]
+        return features, _targets_to_frame(targets)
 
-            feature_columns = [f"{feature_col}_t-{window_size - i}" for i in range(window_size)]
-            all_columns = feature_columns + ["start_station_id", "start_hour"]
-            transformed_df = pd.DataFrame(rows, columns=all_columns)
-            transformed_data.append(transformed_df)
+    windows, station_ids, target_times = new_batch()
+    filled = 0
 
+    for k, location_id in enumerate(location_ids):
+        values = all_values[offsets[k] : offsets[k + 1]]
+        times = all_times[offsets[k] : offsets[k + 1]]
+        try:
+            station_windows = _sliding_windows(values, window_size, step_size, horizon)
         except ValueError as e:
             print(f"Skipping start_station_id {location_id}: {str(e)}")
+            continue
+        station_times = times[window_size::step_size]
+
+        start = 0
+        while start < len(station_windows):
+            n_rows = min(batch_size - filled, len(station_windows) - start)
+            windows[filled : filled + n_rows] = station_windows[start : start + n_rows]
+            station_ids[filled : filled + n_rows] = location_id
+            target_times[filled : filled + n_rows] = station_times[start : start + n_rows]
+            filled += n_rows
+            start += n_rows
+
+            if filled == batch_size:
+                yield to_frame(windows, station_ids, target_times, filled)
+                windows, station_ids, target_times = new_batch()
+                filled = 0
 
-    if not transformed_data:
+    if filled:
+        yield to_frame(windows, station_ids, target_times, filled)
+
+
+def _window_target_hours(df, window_size, step_size, horizon=1):
+    """
+    (First) target hour (as int64 ns, UTC for tz-aware hours) of every
+    window the CitiBike window builders produce, in their row order,
+    computed without building any window.
+    """
+    order, _, offsets = _station_partitions(df["start_station_id"].to_numpy())
+    hours = pd.DatetimeIndex(df["start_hour"])
+    if hours.tz is not None:
+        hours = hours.tz_convert(None)
+    hours = hours.asi8[order]
+    return np.concatenate(
+        [np.empty(0, dtype=np.int64)]
+        + [
+            hours[start + window_size : stop - horizon + 1 : step_size]
+            for start, stop in zip(offsets[:-2], offsets[1:-1])
+            if stop - start >= window_size + horizon
+        ]
+    )
+
+
+def write_ts_windows_memmap(
+    df,
+    windows_dir,
+    feature_col="rides",
+    window_size=12,
+    step_size=1,
+    memory_budget_mb=256,
+    dtype="float32",
+    sort_by_time=False,
+    lags=None,
+    horizon=1,
+):
+    """
+    Writes the windows of iter_ts_windows_and_targets_bike() to memory-mapped
+    .npy files under `windows_dir`, batch by batch, so the window matrix never
+    has to fit in RAM:
+
+    - features.npy: (n_windows, window_size) lag matrix in `dtype`, or only
+      the `lags` columns when given
+    - targets.npy: (n_windows,) targets in `dtype`, or (n_windows, horizon)
+      for `horizon` > 1
+    - start_hours.npy: (n_windows,) (first) target hours as naive
+      datetime64[ns]
+    - station_codes.npy: (n_windows,) int32 index into metadata["stations"]
+    - metadata.json: shapes, window parameters, stations and hour range
+
+    Rows are in the order of the window builders (grouped by station) or,
+    with `sort_by_time`, ordered by target hour so that any time range is a
+    contiguous slice of the files. Returns the metadata. Open the result with load_ts_windows_memmap().
+    """
+    windows_dir = Path(windows_dir)
+    windows_dir.mkdir(parents=True, exist_ok=True)
+
+    n_windows = count_ts_windows_bike(df, window_size=window_size, step_size=step_size, horizon=horizon)
+    if n_windows == 0:
         raise ValueError("No data could be transformed.")
+    stations = pd.Index(pd.unique(df["start_station_id"].dropna()))
+
+    open_memmap = np.lib.format.open_memmap
+    feature_columns = _feature_columns(feature_col, window_size, lags)
+    features = open_memmap(
+        windows_dir / "features.npy", mode="w+", dtype=dtype, shape=(n_windows, len(feature_columns))
+    )
+    target_shape = (n_windows,) if horizon == 1 else (n_windows, horizon)
+    targets = open_memmap(windows_dir / "targets.npy", mode="w+", dtype=dtype, shape=target_shape)
+    start_hours = open_memmap(windows_dir / "start_hours.npy", mode="w+", dtype="datetime64[ns]", shape=(n_windows,))
+    station_codes = open_memmap(windows_dir / "station_codes.npy", mode="w+", dtype=np.int32, shape=(n_windows,))
+
+    # Destination row of every window, in the order they are built
+    destinations = None
+    if sort_by_time:
+        destinations = np.empty(n_windows, dtype=np.int64)
+        destinations[np.argsort(_window_target_hours(df, window_size, step_size, horizon), kind="stable")] = np.arange(
+            n_windows
+        )
+
+    time_zone = None
+    row = 0
+    for batch_features, batch_targets in iter_ts_windows_and_targets_bike(
+        df,
+        feature_col=feature_col,
+        window_size=window_size,
+        step_size=step_size,
+        memory_budget_mb=memory_budget_mb,
+        dtype=dtype,
+        lags=lags,
+        horizon=horizon,
+    ):
+        n_rows = len(batch_features)
+        hours = pd.DatetimeIndex(batch_features["start_hour"])
+        if hours.tz is not None:
+            time_zone = str(hours.tz)
+            hours = hours.tz_convert(None)
+
+        rows = slice(row, row + n_rows) if destinations is None else destinations[row : row + n_rows]
+        features[rows] = batch_features.iloc[:, : len(feature_columns)].to_numpy()
+        targets[rows] = batch_targets.to_numpy()
+        start_hours[rows] = hours.to_numpy()
+        station_codes[rows] = stations.get_indexer(batch_features["start_station_id"].to_numpy())
+        row += n_rows
+
+    for array in (features, targets, start_hours, station_codes):
+        array.flush()
+
+    metadata = {
+        "n_windows": n_windows,
+        "feature_col": feature_col,
+        "window_size": window_size,
+        "step_size": step_size,
+        "horizon": horizon,
+        "dtype": np.dtype(dtype).name,
+        "sorted_by_time": sort_by_time,
+        "feature_columns": feature_columns,
+        "stations": [str(station) for station in stations],
+        "first_hour": str(start_hours.min()),
+        "last_hour": str(start_hours.max()),
+        "time_zone": time_zone,
+    }
+    (windows_dir / "metadata.json").write_text(json.dumps(metadata, indent=2))
+    return metadata
+
+
+def load_ts_windows_memmap(windows_dir, mmap_mode="r"):
+    """
+    Opens the window files written by write_ts_windows_memmap() without
+    reading them. Returns a dict with the memory-mapped "features",
+    "targets", "start_hours" and "station_codes" arrays and the "metadata".
+    """
+    windows_dir = Path(windows_dir)
+    windows = {
+        name: np.load(windows_dir / f"{name}.npy", mmap_mode=mmap_mode)
+        for name in ("features", "targets", "start_hours", "station_codes")
+    }
+    windows["metadata"] = json.loads((windows_dir / "metadata.json").read_text())
+    return windows
+
+
+def ts_windows_frame(windows, rows=slice(None)):
+    """
+    Features and targets of `rows` of a load_ts_windows_memmap() result, in
+    the layout returned by transform_ts_data_info_features_and_target_bike().
+    The lag columns are a view of the memory map, so a slice only reads the
+    pages it touches.
+    """
+    metadata = windows["metadata"]
+    features = pd.DataFrame(windows["features"][rows], columns=metadata["feature_columns"], copy=False)
 
-    return pd.concat(transformed_data, ignore_index=True)
+    start_hours = pd.DatetimeIndex(windows["start_hours"][rows])
+    if metadata["time_zone"] is not None:
+        start_hours = start_hours.tz_localize("UTC").tz_convert(metadata["time_zone"])
+    features["start_hour"] = start_hours
+    features["start_station_id"] = pd.Categorical.from_codes(
+        windows["station_codes"][rows], categories=metadata["stations"]
+    )
+    return features, _targets_to_frame(windows["targets"][rows])
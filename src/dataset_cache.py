@@ -0,0 +1,176 @@
+"""
+dataset_cache.py – LightGBM binned Dataset cache shared by weekly retrains.
+
+Building a LightGBM Dataset from the 675-column model input means sampling
+every column to find its histogram bins and then mapping every value to
+its bin. Consecutive weekly retrains see mostly the same 180 days, so the
+training pipeline keeps the last constructed Dataset in `cache_dir`:
+
+- dataset.bin: the full binned Dataset, labels included
+- bins.bin: a few rows of it, which carries only the bin boundaries
+- metadata.json: feature-set key, row range, data fingerprint and the
+  range the bins were computed from
+
+`DatasetCache.get()` then either
+
+1. loads dataset.bin as-is when the feature set, row range and data
+   fingerprint are unchanged ("hit"),
+2. bins the new rows against the cached bin boundaries when the feature
+   set is unchanged and the ranges overlap enough ("extended"), which
+   skips the bin search, or
+3. builds the Dataset from scratch ("miss").
+
+LightGBM cannot append rows to a constructed Dataset, so (2) still maps
+every row. Bins are recomputed after `max_bin_age_days` so they follow
+the data as it drifts.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, Optional
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+# Binning parameters of every Dataset built by the training pipeline.
+# feature_pre_filter is off so a Dataset built for one min_child_samples
+# can be trained with another.
+DATASET_PARAMETERS = {"max_bin": 255, "feature_pre_filter": False, "verbose": -1}
+
+_BINS_ROWS = 1000
+_FINGERPRINT_ROWS = 1000
+
+
+def _feature_key(feature_names, dataset_params) -> str:
+    payload = json.dumps({"features": list(feature_names), "params": dataset_params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _data_fingerprint(model_input, targets) -> str:
+    """
+    Hash of all `targets` and of about `_FINGERPRINT_ROWS` evenly spaced
+    rows of `model_input`, so a backfill that rewrites rows inside the same
+    hour range is not taken for a cache hit.
+    """
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(targets).tobytes())
+    step = max(1, len(targets) // _FINGERPRINT_ROWS)
+    digest.update(np.ascontiguousarray(model_input[::step]).tobytes())
+    return digest.hexdigest()
+
+
+class DatasetCache:
+    """Keeps the last binned training Dataset on disk for the next retrain."""
+
+    def __init__(
+        self,
+        cache_dir,
+        dataset_params: Optional[Dict] = None,
+        min_overlap: float = 0.5,
+        max_bin_age_days: int = 56,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.dataset_params = dict(DATASET_PARAMETERS if dataset_params is None else dataset_params)
+        self.min_overlap = min_overlap
+        self.max_bin_age_days = max_bin_age_days
+        self.last_status = None
+
+    @property
+    def dataset_path(self) -> Path:
+        return self.cache_dir / "dataset.bin"
+
+    @property
+    def bins_path(self) -> Path:
+        return self.cache_dir / "bins.bin"
+
+    @property
+    def metadata_path(self) -> Path:
+        return self.cache_dir / "metadata.json"
+
+    def files(self):
+        """The files making up the cache, e.g. to persist them elsewhere."""
+        return [self.dataset_path, self.bins_path, self.metadata_path]
+
+    def _read_metadata(self) -> Optional[Dict]:
+        if not all(path.exists() for path in self.files()):
+            return None
+        return json.loads(self.metadata_path.read_text())
+
+    def _reuse_bins(self, metadata: Dict, first_hour: pd.Timestamp, last_hour: pd.Timestamp) -> bool:
+        cached_first = pd.Timestamp(metadata["first_hour"])
+        cached_last = pd.Timestamp(metadata["last_hour"])
+        overlap = (min(cached_last, last_hour) - max(cached_first, first_hour)) / max(
+            last_hour - first_hour, pd.Timedelta(hours=1)
+        )
+        bin_age = last_hour - pd.Timestamp(metadata["bins_last_hour"])
+        return overlap >= self.min_overlap and bin_age <= pd.Timedelta(days=self.max_bin_age_days)
+
+    def get(self, model_input, targets, feature_names, start_hours) -> lgb.Dataset:
+        """
+        Constructed Dataset of `model_input` and `targets`, whose rows have
+        the time-sorted target hours `start_hours`. The result replaces the
+        cached Dataset; `last_status` tells how it was obtained.
+        """
+        key = _feature_key(feature_names, self.dataset_params)
+        fingerprint = _data_fingerprint(model_input, targets)
+        first_hour = pd.Timestamp(start_hours[0])
+        last_hour = pd.Timestamp(start_hours[-1])
+        metadata = self._read_metadata()
+        if metadata is not None and metadata["key"] != key:
+            metadata = None
+
+        if (
+            metadata is not None
+            and metadata["n_rows"] == len(targets)
+            and pd.Timestamp(metadata["first_hour"]) == first_hour
+            and pd.Timestamp(metadata["last_hour"]) == last_hour
+            and metadata.get("fingerprint") == fingerprint
+        ):
+            self.last_status = "hit"
+            return lgb.Dataset(str(self.dataset_path), params=self.dataset_params).construct()
+
+        reference = None
+        if metadata is not None and self._reuse_bins(metadata, first_hour, last_hour):
+            self.last_status = "extended"
+            reference = lgb.Dataset(str(self.bins_path), params=self.dataset_params).construct()
+            bins_first_hour, bins_last_hour = metadata["bins_first_hour"], metadata["bins_last_hour"]
+        else:
+            self.last_status = "miss"
+            bins_first_hour, bins_last_hour = str(first_hour), str(last_hour)
+
+        dataset = lgb.Dataset(
+            model_input,
+            label=np.asarray(targets),
+            feature_name=list(feature_names),
+            reference=reference,
+            params=self.dataset_params,
+            free_raw_data=True,
+        ).construct()
+        self._store(dataset, key, fingerprint, len(targets), first_hour, last_hour, bins_first_hour, bins_last_hour)
+        return dataset
+
+    def _store(self, dataset, key, fingerprint, n_rows, first_hour, last_hour, bins_first_hour, bins_last_hour):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Invalidate first, so an interrupted write is never taken for a hit
+        self.metadata_path.unlink(missing_ok=True)
+        for path in (self.dataset_path, self.bins_path):
+            path.unlink(missing_ok=True)
+
+        dataset.save_binary(str(self.dataset_path))
+        dataset.subset(list(range(min(_BINS_ROWS, n_rows)))).construct().save_binary(str(self.bins_path))
+        self.metadata_path.write_text(
+            json.dumps(
+                {
+                    "key": key,
+                    "fingerprint": fingerprint,
+                    "n_rows": n_rows,
+                    "first_hour": str(first_hour),
+                    "last_hour": str(last_hour),
+                    "bins_first_hour": bins_first_hour,
+                    "bins_last_hour": bins_last_hour,
+                },
+                indent=2,
+            )
+        )
@@ -3,16 +3,20 @@ import os
 import sys
 from datetime import datetime, timedelta, timezone
 
-import hopsworks
 import pandas as pd
 
 from src.config import (
-    HOPSWORKS_PROJECT_NAME,
-    HOPSWORKS_API_KEY,
+    FEATURE_GROUP_LAGS,
     FEATURE_GROUP_NAME,
     FEATURE_GROUP_VERSION,
+    FEATURE_STATE_PATH,
 )
-from src.feature_utils import build_features_for_citibike
+from src.feature_utils import (
+    build_features_for_citibike,
+    build_incremental_features_for_citibike,
+    save_feature_state,
+)
+from src.inference import get_feature_store, get_hopsworks_project
 
 # ─────────────────────────────────────────────────────────────
 # Configure Logging
@@ -27,10 +31,16 @@ logger = logging.getLogger(__name__)
 # ─────────────────────────────────────────────────────────────
 # Step 1: Time Range Setup
 # ─────────────────────────────────────────────────────────────
-current_date = pd.to_datetime(datetime.now(timezone.utc)).ceil("h")
+# The hour in progress is still collecting trips, so features stop at the
+# last closed hour: fetch_data_to is the (exclusive) current hour
+current_date = pd.to_datetime(datetime.now(timezone.utc)).floor("h")
 fetch_data_to = current_date
 fetch_data_from = current_date - timedelta(days=28)
 
+# Incremental runs only emit the hours closed since the last run; pass
+# --full to rebuild and re-insert the whole 28-day window.
+full_rebuild = "--full" in sys.argv
+
 logger.info(f"Running CitiBike Feature Pipeline")
 logger.info(f"Current datetime (UTC): {current_date}")
 logger.info(f"Fetching ride data from {fetch_data_from} to {fetch_data_to}")
@@ -38,7 +48,7 @@ logger.info(f"Fetching ride data from {fetch_data_from} to {fetch_data_to}")
 # ─────────────────────────────────────────────────────────────
 # Step 2: Login and Dataset Fetch
 # ─────────────────────────────────────────────────────────────
-project = hopsworks.login(project=HOPSWORKS_PROJECT_NAME, api_key_value=HOPSWORKS_API_KEY)
+project = get_hopsworks_project()
 dataset_api = project.get_dataset_api()
 
 local_parquet_path = "data/processed/2023/citibike_2023_all.parquet"
@@ -49,19 +59,34 @@ if not os.path.exists(local_parquet_path):
     dataset_api.download("Resources/citibike/citibike_2023_all.parquet/citibike_2023_all.parquet", local_path=local_parquet_path)
     logger.info("Download complete.")
 
+# The per-station history of the incremental build lives next to the raw data
+remote_state_path = f"Resources/citibike/{FEATURE_STATE_PATH.name}"
+if not full_rebuild and not FEATURE_STATE_PATH.exists() and dataset_api.exists(remote_state_path):
+    logger.info("Downloading incremental feature state from Hopsworks Dataset storage...")
+    dataset_api.download(remote_state_path, local_path=str(FEATURE_STATE_PATH))
+
 # ─────────────────────────────────────────────────────────────
 # Step 3: Feature Engineering
 # ─────────────────────────────────────────────────────────────
-logger.info("Building features for CitiBike...")
-ts_data = build_features_for_citibike(fetch_data_from, fetch_data_to, parquet_path=local_parquet_path)
-ts_data = ts_data.copy()  # ← Fixes fragmentation warning
+ts_data = history = None
+if not full_rebuild:
+    logger.info("Building features for newly closed hours...")
+    ts_data, history = build_incremental_features_for_citibike(
+        fetch_data_to, parquet_path=local_parquet_path, state_path=FEATURE_STATE_PATH, lags=FEATURE_GROUP_LAGS
+    )
+if ts_data is None:
+    logger.info("Building features for CitiBike...")
+    ts_data = build_features_for_citibike(
+        fetch_data_from, fetch_data_to, parquet_path=local_parquet_path, lags=FEATURE_GROUP_LAGS
+    )
+    history = ts_data
 logger.info(f"Generated time-series features: {ts_data.shape[0]} rows, {ts_data.shape[1]} columns")
 
 # ─────────────────────────────────────────────────────────────
 # Step 4: Create or Replace Feature Group
 # ─────────────────────────────────────────────────────────────
 logger.info("Connecting to the Feature Store...")
-feature_store = project.get_feature_store()
+feature_store = get_feature_store()
 
 logger.info(f"Registering or updating Feature Group: {FEATURE_GROUP_NAME} (v{FEATURE_GROUP_VERSION})...")
 feature_group = feature_store.get_or_create_feature_group(
@@ -79,5 +104,14 @@ if ts_data.shape[0] == 0:
     logger.warning("No data rows to insert — skipping write to feature store.")
 else:
     logger.info("Inserting data into Feature Store...")
-    feature_group.insert(ts_data, write_options={"wait_for_job": False})
+    # Waits for the materialization job, which raises if it fails, so the
+    # state below is only advanced past hours that were stored
+    feature_group.insert(ts_data, write_options={"wait_for_job": True})
     logger.info("✅ Feature data successfully inserted.")
+
+# ─────────────────────────────────────────────────────────────
+# Step 6: Advance the incremental feature state
+# ─────────────────────────────────────────────────────────────
+save_feature_state(history, FEATURE_STATE_PATH, fetch_data_to)
+dataset_api.upload(str(FEATURE_STATE_PATH), "Resources/citibike", overwrite=True)
+logger.info("Saved incremental feature state.")
@@ -1,53 +1,474 @@
 # src/feature_utils.py
 
-def build_features_for_citibike(start_time, end_time, parquet_path):
+def read_trips_in_range(parquet_path, start_time, end_time, columns=("started_at", "start_station_id")):
+    """
+    Reads the trips whose `started_at` hour falls in [start_time, end_time)
+    from a Parquet file or directory.
+
+    The time range is pushed into the Parquet scan, so row groups whose
+    `started_at` statistics fall outside it are skipped and only `columns`
+    are decoded. `started_at` may be stored as a timestamp or as an ISO
+    formatted string.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(parquet_path, format="parquet")
+    started_at_type = dataset.schema.field("started_at").type
+
+    # Bounds on the raw column, widened to whole hours
+    lower = pd.Timestamp(start_time).floor("h")
+    upper = pd.Timestamp(end_time).ceil("h")
+    if pa.types.is_timestamp(started_at_type):
+        lower = pa.scalar(lower, type=started_at_type)
+        upper = pa.scalar(upper, type=started_at_type)
+    else:
+        lower = lower.strftime("%Y-%m-%d %H:%M:%S")
+        upper = upper.strftime("%Y-%m-%d %H:%M:%S")
+    time_filter = (ds.field("started_at") >= lower) & (ds.field("started_at") < upper)
+
+    df = dataset.to_table(columns=list(columns), filter=time_filter).to_pandas()
+    df["start_time"] = pd.to_datetime(df["started_at"]).dt.floor("h")
+    return df[(df["start_time"] >= start_time) & (df["start_time"] < end_time)]
+
+
+def _read_counts_watermark(counts_dir):
+    import json
+    from pathlib import Path
+
+    import pandas as pd
+
+    path = Path(counts_dir) / "_watermark.json"
+    if not path.exists():
+        return None, None
+    watermark = json.loads(path.read_text())
+    return pd.Timestamp(watermark["first_hour"]), pd.Timestamp(watermark["end_hour"])
+
+
+def _write_hourly_counts(hourly_df, counts_dir, start_time, end_time):
+    """Appends one file per date partition for the hours in [start_time, end_time)."""
+    from pathlib import Path
+
+    if hourly_df.empty:
+        return
+    for date, day_df in hourly_df.groupby(hourly_df["start_hour"].dt.strftime("%Y-%m-%d")):
+        partition_dir = Path(counts_dir) / f"date={date}"
+        partition_dir.mkdir(parents=True, exist_ok=True)
+        file_name = f"part-{start_time:%Y%m%d%H}-{end_time:%Y%m%d%H}.parquet"
+        day_df.reset_index(drop=True).to_parquet(partition_dir / file_name, index=False)
+
+
+def update_hourly_counts(parquet_path, counts_dir, start_time, end_time):
+    """
+    Brings the materialized station x hour ride-count table in `counts_dir`
+    up to date for the hours in [start_time, end_time).
+
+    The table is a Parquet dataset partitioned by date (`date=YYYY-MM-DD/`)
+    holding the non-zero `rides` per `start_station_id` and `start_hour`.
+    The hours already covered are recorded in `_watermark.json`, so only
+    hours outside that range are aggregated from the raw trips and
+    appended. Covered hours are never recounted, so `end_time` is capped at
+    the current (UTC) hour: an hour still in progress is never stored.
+
+    The table is a local cache: it only saves work across runs on a host
+    that keeps `counts_dir`. On an ephemeral runner every run starts empty
+    and aggregates the whole range, like a build without the table.
+    """
+    import json
+    from pathlib import Path
+
+    import pandas as pd
+
+    current_hour = pd.Timestamp.now(tz="UTC").tz_localize(None).floor("h")
+    start_time = pd.Timestamp(start_time).floor("h")
+    end_time = min(pd.Timestamp(end_time).floor("h"), current_hour)
+    if end_time <= start_time:
+        return
+    first_hour, end_hour = _read_counts_watermark(counts_dir)
+
+    if first_hour is None:
+        missing_ranges = [(start_time, end_time)]
+        first_hour, end_hour = start_time, end_time
+    else:
+        # The covered range only ever grows, so it stays contiguous
+        missing_ranges = [(start_time, first_hour), (end_hour, end_time)]
+        first_hour, end_hour = min(first_hour, start_time), max(end_hour, end_time)
+
+    for range_start, range_end in missing_ranges:
+        if range_start >= range_end:
+            continue
+        trips = read_trips_in_range(parquet_path, range_start, range_end)
+        hourly_df = (
+            trips.groupby(["start_station_id", "start_time"])
+            .size()
+            .reset_index(name="rides")
+            .rename(columns={"start_time": "start_hour"})
+        )
+        _write_hourly_counts(hourly_df, counts_dir, range_start, range_end)
+
+    Path(counts_dir).mkdir(parents=True, exist_ok=True)
+    (Path(counts_dir) / "_watermark.json").write_text(
+        json.dumps({"first_hour": first_hour.isoformat(), "end_hour": end_hour.isoformat()})
+    )
+
+
+def _empty_hourly_counts():
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "start_station_id": pd.Series(dtype=object),
+            "start_hour": pd.Series(dtype="datetime64[ns]"),
+            "rides": pd.Series(dtype="int64"),
+        }
+    )
+
+
+def read_hourly_counts(counts_dir, start_time, end_time):
+    """
+    Reads the per-station hourly ride counts in [start_time, end_time) from
+    the materialized table, skipping date partitions outside the range.
+    Returns an empty frame when the table holds no counts yet (e.g. no
+    trips in any range stored so far).
+    """
+    from pathlib import Path
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    start_time = pd.Timestamp(start_time)
+    end_time = pd.Timestamp(end_time)
+    if not Path(counts_dir).exists():
+        return _empty_hourly_counts()
+    partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    dataset = ds.dataset(counts_dir, format="parquet", partitioning=partitioning)
+    if not dataset.files:
+        # Only the watermark is stored, so there is no schema to filter on
+        return _empty_hourly_counts()
+    hour_type = dataset.schema.field("start_hour").type
+    time_filter = (
+        (ds.field("date") >= f"{start_time:%Y-%m-%d}")
+        & (ds.field("date") <= f"{end_time:%Y-%m-%d}")
+        & (ds.field("start_hour") >= pa.scalar(start_time, type=hour_type))
+        & (ds.field("start_hour") < pa.scalar(end_time, type=hour_type))
+    )
+    return dataset.to_table(
+        columns=["start_station_id", "start_hour", "rides"], filter=time_filter
+    ).to_pandas()
+
+
+def build_features_for_citibike(start_time, end_time, parquet_path, counts_dir=None, lags=None):
+    """
+    Builds bike_hourly_fg rows for every station and every closed hour in
+    [start_time, end_time). The last hour's `target_t_plus_1` is NaN
+    until the next hour closes.
+    """
     import pandas as pd
     import numpy as np
     import holidays
 
+    import src.config as config
+
     # Strip timezone awareness
     start_time = start_time.replace(tzinfo=None)
     end_time = end_time.replace(tzinfo=None)
 
-    # Load and filter December 2023
-    df = pd.read_parquet(parquet_path, columns=["started_at", "start_station_id"])
-    df["start_time"] = pd.to_datetime(df["started_at"]).dt.floor("H")
-    df = df[df["start_time"].dt.month == 12]
-    df = df[(df["start_time"] >= start_time) & (df["start_time"] < end_time)]
-
-    hourly_df = (
-        df.groupby(["start_station_id", "start_time"])
-        .size()
-        .reset_index(name="rides")
-    )
+    # Hourly counts come from the materialized table; only hours it does
+    # not cover yet are aggregated from the raw trips
+    counts_dir = counts_dir or config.HOURLY_COUNTS_DIR
+    update_hourly_counts(parquet_path, counts_dir, start_time, end_time)
+    hourly_df = read_hourly_counts(counts_dir, start_time, end_time)
 
     full_index = pd.MultiIndex.from_product(
-        [hourly_df["start_station_id"].unique(), pd.date_range(start=start_time, end=end_time, freq="H")],
+        [
+            hourly_df["start_station_id"].unique(),
+            pd.date_range(start=start_time, end=end_time, freq="h", inclusive="left"),
+        ],
         names=["start_station_id", "start_hour"]
     )
     df_full = (
-        hourly_df.set_index(["start_station_id", "start_time"])
+        hourly_df.set_index(["start_station_id", "start_hour"])
         .reindex(full_index, fill_value=0)
-        .rename_axis(index=["start_station_id", "start_hour"])
         .reset_index()
     )
 
-    return add_lag_features_and_calendar_flags(df_full)
+    return add_lag_features_and_calendar_flags(df_full, lags=lags)
+
+
+def save_feature_state(df, state_path, end_time, history_hours=673):
+    """
+    Persists the trailing `history_hours` closed hours (before `end_time`)
+    of `rides` per station, the history the incremental feature build needs:
+    672 lags for the last saved hour, which the next build emits again.
+
+    Stations without a ride in that window are left out, so the state does
+    not grow with every station ever seen; if one returns, the incremental
+    build seeds it with the same all-zero history.
+    """
+    from pathlib import Path
 
+    import pandas as pd
+
+    end_time = pd.Timestamp(end_time).replace(tzinfo=None)
+    in_window = (df["start_hour"] >= end_time - pd.Timedelta(hours=history_hours)) & (
+        df["start_hour"] < end_time
+    )
+    state = df.loc[in_window, ["start_station_id", "start_hour", "rides"]]
+    active = state.groupby("start_station_id")["rides"].transform("sum") > 0
+    Path(state_path).parent.mkdir(parents=True, exist_ok=True)
+    state[active].reset_index(drop=True).to_parquet(state_path, index=False)
+
+
+def build_incremental_features_for_citibike(end_time, parquet_path, state_path, counts_dir=None, lags=None):
+    """
+    Builds bike_hourly_fg rows only for the hours closed since the last run.
+
+    The per-station history saved by save_feature_state() at `state_path`
+    supplies the lags and rolling windows, so features are computed for the
+    new hours in [last saved hour + 1h, end_time) alone. The last saved
+    hour is emitted again with the `target_t_plus_1` that is now known, so
+    after an upsert the rows equal those of a full rebuild.
+
+    Returns the new feature rows and the extended history; pass the latter
+    to save_feature_state() once the rows are stored. Returns (None, None)
+    when no (or an empty) state exists yet, in which case a full
+    build_features_for_citibike() run is needed first.
+    """
+    from pathlib import Path
+
+    import pandas as pd
 
-def add_lag_features_and_calendar_flags(df):
+    import src.config as config
+
+    if not Path(state_path).exists():
+        return None, None
+
+    end_time = pd.Timestamp(end_time).replace(tzinfo=None).floor("h")
+    state = pd.read_parquet(state_path)
+    if state.empty:
+        # No station had a ride in the saved window, so there is nothing
+        # to continue from
+        return None, None
+    first_new_hour = state["start_hour"].max() + pd.Timedelta(hours=1)
+    if first_new_hour >= end_time:
+        return state.iloc[:0], state
+
+    counts_dir = counts_dir or config.HOURLY_COUNTS_DIR
+    update_hourly_counts(parquet_path, counts_dir, first_new_hour, end_time)
+    new_counts = read_hourly_counts(counts_dir, first_new_hour, end_time)
+
+    state_stations = pd.Index(state["start_station_id"].unique())
+    new_index = pd.MultiIndex.from_product(
+        [
+            state_stations.union(new_counts["start_station_id"].unique()),
+            pd.date_range(start=first_new_hour, end=end_time, freq="h", inclusive="left"),
+        ],
+        names=["start_station_id", "start_hour"],
+    )
+    new_rows = (
+        new_counts.set_index(["start_station_id", "start_hour"])
+        .reindex(new_index, fill_value=0)
+        .reset_index()
+    )
+
+    # Stations not in the state (new, or pruned while inactive) get the
+    # zero history a full rebuild fills in for them
+    seed = pd.MultiIndex.from_product(
+        [
+            pd.Index(new_counts["start_station_id"].unique()).difference(state_stations),
+            pd.date_range(start=state["start_hour"].min(), end=first_new_hour, freq="h", inclusive="left"),
+        ],
+        names=["start_station_id", "start_hour"],
+    ).to_frame(index=False).assign(rides=0)
+    history = pd.concat([state, seed, new_rows], ignore_index=True)
+
+    last_saved_hour = first_new_hour - pd.Timedelta(hours=1)
+    features = add_lag_features_and_calendar_flags(history, since=last_saved_hour, lags=lags)
+    return features, history
+
+
+def _station_ordinals(station_ids):
+    """
+    For rows sorted by station, returns the ordinal of each row's station and
+    the row's position within its station.
+    """
+    import numpy as np
+
+    n_rows = len(station_ids)
+    is_first = np.ones(n_rows, dtype=bool)
+    is_first[1:] = station_ids[1:] != station_ids[:-1]
+    starts = np.flatnonzero(is_first)
+    station_ordinal = np.cumsum(is_first) - 1
+    position = np.arange(n_rows) - starts[station_ordinal]
+    return station_ordinal, position
+
+
+def _lag_block(df, lags, value_col="rides", group_col="start_station_id", rows=None):
+    """
+    Lag columns for the rows selected by the boolean mask `rows` (all rows
+    by default). Every row of `df` is used as history.
+    """
     import numpy as np
+    import pandas as pd
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    lags = np.asarray(list(lags), dtype=np.int64)
+    max_lag = int(lags.max())
+    values = df[value_col].to_numpy(dtype=np.float64)
+    n_rows = len(values)
+
+    # Lay the series out with `max_lag` NaNs in front of every station, so
+    # lags reaching back past a station's first row read NaN
+    station_ordinal, _ = _station_ordinals(df[group_col].to_numpy())
+    n_stations = station_ordinal[-1] + 1 if n_rows else 0
+    # One spare slot keeps the strided view valid for an empty frame
+    padded = np.full(n_rows + n_stations * max_lag + 1, np.nan)
+    window_start = np.arange(n_rows) + station_ordinal * max_lag
+    padded[window_start + max_lag] = values
+
+    index = df.index
+    if rows is not None:
+        window_start = window_start[rows]
+        index = index[rows]
+
+    # Window i of the view holds the `max_lag` values before row i and the
+    # row itself, so lag k is column max_lag - k. Gathering the lag columns
+    # for the selected rows is the only copy.
+    windows = sliding_window_view(padded, min(max_lag + 1, len(padded)))
+    block = windows[window_start[:, None], (max_lag - lags)[None, :]]
+    return pd.DataFrame(block, index=index, columns=[f"lag_{lag}" for lag in lags])
+
+
+def add_lag_features(df, lags=range(1, 673), value_col="rides", group_col="start_station_id"):
+    """
+    Adds `lag_<k>` columns equal to groupby(group_col)[value_col].shift(k)
+    for every k in `lags`.
+
+    `df` must already be sorted by station and hour. The whole lag block is
+    built as one 2-D array from strided views of the series and attached in
+    a single concat, instead of one groupby/shift and one column insert per
+    lag.
+    """
+    import pandas as pd
+
+    lag_df = _lag_block(df, lags, value_col, group_col)
+    return pd.concat([df, lag_df], axis=1, copy=False)
+
+
+def _sliding_max(values, window):
+    """
+    Max of every `window` consecutive values, in O(n) regardless of the
+    window (van Herk / Gil-Werman). Element j is max(values[j : j + window]).
+    """
+    import numpy as np
+
+    n_blocks = -(-len(values) // window)
+    padded = np.full(n_blocks * window, -np.inf)
+    padded[: len(values)] = values
+    blocks = padded.reshape(n_blocks, window)
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    n_windows = len(values) - window + 1
+    return np.maximum(suffix[:n_windows], prefix[window - 1 : window - 1 + n_windows])
+
+
+def _rolling_columns(
+    df, windows, stats, value_col="rides", group_col="start_station_id", rows=None
+):
+    """
+    Rolling statistic columns for the rows selected by the boolean mask
+    `rows` (all rows by default). Every row of `df` is used as history.
+    """
+    import numpy as np
+    import pandas as pd
+
+    unknown = set(stats) - {"mean", "sum", "max", "std"}
+    if unknown:
+        raise ValueError(f"Unsupported rolling statistics: {sorted(unknown)}")
+
+    values = df[value_col].to_numpy(dtype=np.float64)
+    _, position = _station_ordinals(df[group_col].to_numpy())
+    targets = np.arange(len(values)) if rows is None else np.flatnonzero(rows)
+    index = df.index if rows is None else df.index[rows]
+
+    # cumsum[t] is the sum of values[:t], so the window ending before row t
+    # sums to cumsum[t] - cumsum[t - window]
+    cumsum = np.concatenate([[0.0], np.cumsum(values)])
+    if "std" in stats:
+        cumsum_sq = np.concatenate([[0.0], np.cumsum(values**2)])
+
+    columns = {}
+    for window in windows:
+        valid = np.flatnonzero(position[targets] >= window)
+        ends = targets[valid]
+        window_sum = cumsum[ends] - cumsum[ends - window]
+
+        for stat in stats:
+            column = np.full(len(targets), np.nan)
+            if stat == "sum":
+                column[valid] = window_sum
+            elif stat == "mean":
+                column[valid] = window_sum / window
+            elif stat == "std" and window > 1:
+                window_sum_sq = cumsum_sq[ends] - cumsum_sq[ends - window]
+                variance = (window_sum_sq - window_sum**2 / window) / (window - 1)
+                column[valid] = np.sqrt(np.clip(variance, 0, None))
+            elif stat == "max" and len(valid):
+                column[valid] = _sliding_max(values, window)[ends - window]
+            columns[f"roll{stat}_{window}"] = column
+
+    return pd.DataFrame(columns, index=index)
+
+
+def add_rolling_features(
+    df, windows=(24, 168), stats=("mean",), value_col="rides", group_col="start_station_id"
+):
+    """
+    Adds `roll<stat>_<window>` columns with rolling statistics of the
+    `window` hours before each row (the current hour is excluded), computed
+    within each station.
+
+    `df` must already be sorted by station and hour. Rows with fewer than
+    `window` earlier hours in their station get NaN, so windows never mix
+    two stations. Sums, means and standard deviations come from one pair of
+    cumulative sums shared by every window; maxima use a linear-time sliding
+    max. Supported stats are "mean", "sum", "max" and "std" (ddof=1, like
+    pandas).
+    """
+    import pandas as pd
+
+    rolling_df = _rolling_columns(df, windows, stats, value_col, group_col)
+    return pd.concat([df, rolling_df], axis=1, copy=False)
+
+
+def add_lag_features_and_calendar_flags(df, since=None, lags=None):
+    """
+    Adds the lag, rolling, calendar and target columns of bike_hourly_fg.
+
+    `lags` restricts the lag columns to those hours (e.g. a model's pruned
+    lag list); by default lag_1 to lag_672 are added.
+
+    With `since` set, rows before that hour only serve as history for the
+    lags and rolling windows: features are computed and returned for the
+    rows from `since` onwards only.
+    """
+    import numpy as np
+    import pandas as pd
     import holidays
 
     df = df.sort_values(["start_station_id", "start_hour"])
+    rows = None if since is None else (df["start_hour"] >= since).to_numpy()
 
-    # Add full range of lag features (lag_1 to lag_672)
-    for lag in range(1, 673):
-        df[f"lag_{lag}"] = df.groupby("start_station_id")["rides"].shift(lag)
-
-    # Rolling means
-    df["rollmean_24"] = df.groupby("start_station_id")["rides"].shift(1).rolling(window=24).mean()
-    df["rollmean_168"] = df.groupby("start_station_id")["rides"].shift(1).rolling(window=168).mean()
+    # Lag features (by default the full lag_1 to lag_672 range) and rolling
+    # means over the previous day and week of each station
+    lag_df = _lag_block(df, range(1, 673) if lags is None else sorted(lags), rows=rows)
+    rolling_df = _rolling_columns(df, windows=(24, 168), stats=("mean",), rows=rows)
+    target = df.groupby("start_station_id")["rides"].shift(-1)
+    if rows is not None:
+        df, target = df[rows], target[rows]
+    df = pd.concat([df, lag_df, rolling_df], axis=1, copy=False)
 
     # Time-based features
     df["hour"] = df["start_hour"].dt.hour
@@ -61,9 +482,9 @@ def add_lag_features_and_calendar_flags(df):
 
     # Holiday flag
     us_holidays = holidays.US(years=[2023])
-    df["is_holiday"] = df["start_hour"].dt.date.astype("datetime64").isin(us_holidays)
+    df["is_holiday"] = df["start_hour"].dt.normalize().isin(pd.to_datetime(list(us_holidays)))
 
     # Forecast target
-    df["target_t_plus_1"] = df.groupby("start_station_id")["rides"].shift(-1)
+    df["target_t_plus_1"] = target
 
     return df
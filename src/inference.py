@@ -1,30 +1,213 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
 
-import hopsworks
 import numpy as np
 import pandas as pd
-from hsfs.feature_store import FeatureStore
 
 import src.config as config
-from src.data_utils import transform_ts_data_info_features_bike as transform_ts_data_info_features
+from src.data_utils import transform_ts_data_latest_window_bike
+from src.model_cache import ModelCache
+
+if TYPE_CHECKING:
+    import hopsworks
+    from hsfs.feature_store import FeatureStore
+
+
+def _reconnect_errors() -> tuple:
+    """Errors after which the session logs in again: network failures and Hopsworks REST errors (e.g. 401)."""
+    if config.FEATURE_STORE_BACKEND == "local":
+        return (OSError,)
+    from hopsworks.client.exceptions import RestAPIError
+
+    # requests' connection errors subclass OSError
+    return (OSError, RestAPIError)
+
+
+class _HopsworksSession:
+    """
+    Process-wide Hopsworks connection shared by every helper in this module.
+    With FEATURE_STORE_BACKEND=local the project is a src.local_store
+    LocalProject instead, which offers the same handles offline.
+
+    Logs in on first use and then reuses the project, feature store and model
+    registry handles. reset() drops them, and the next access logs in again;
+    a connection or authentication error while getting a handle does the
+    same once before it is raised.
+    Access is serialized with a lock so threads (e.g. Streamlit sessions)
+    never log in concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handles = {}
+        self.logins = 0
+        self.login_seconds = 0.0
+        self.reuses = 0
+        self.reconnects = 0
+
+    def _get(self, name, factory):
+        with self._lock:
+            if name in self._handles:
+                self.reuses += 1
+            else:
+                self._handles[name] = factory()
+            return self._handles[name]
+
+    def _login(self):
+        start = time.perf_counter()
+        if config.FEATURE_STORE_BACKEND == "local":
+            from src.local_store import LocalProject
+
+            project = LocalProject(config.LOCAL_FEATURE_STORE_DIR)
+        else:
+            # Imported here so the local backend runs without the Hopsworks client
+            import hopsworks
+
+            project = hopsworks.login(
+                project=config.HOPSWORKS_PROJECT_NAME, api_key_value=config.HOPSWORKS_API_KEY
+            )
+        self.login_seconds += time.perf_counter() - start
+        self.logins += 1
+        return project
+
+    def _get_or_reconnect(self, name, factory):
+        try:
+            return self._get(name, factory)
+        except _reconnect_errors() as error:
+            print(f"Hopsworks {name} unavailable ({error!r}), logging in again")
+            with self._lock:
+                self._handles.clear()
+                self.reconnects += 1
+            return self._get(name, factory)
+
+    def project(self):
+        return self._get_or_reconnect("project", self._login)
+
+    # The project is fetched without a retry of its own, so one failure
+    # costs at most one extra login
+    def feature_store(self):
+        return self._get_or_reconnect(
+            "feature_store", lambda: self._get("project", self._login).get_feature_store()
+        )
+
+    def model_registry(self):
+        return self._get_or_reconnect(
+            "model_registry", lambda: self._get("project", self._login).get_model_registry()
+        )
+
+    def reset(self):
+        with self._lock:
+            self._handles.clear()
+
+    def stats(self):
+        with self._lock:
+            mean_login_seconds = self.login_seconds / self.logins if self.logins else 0.0
+            return {
+                "logins": self.logins,
+                "login_seconds": self.login_seconds,
+                "reuses": self.reuses,
+                "reconnects": self.reconnects,
+                "login_seconds_avoided": self.reuses * mean_login_seconds,
+            }
 
 
-def get_hopsworks_project() -> hopsworks.project.Project:
-    return hopsworks.login(
-        project=config.HOPSWORKS_PROJECT_NAME, api_key_value=config.HOPSWORKS_API_KEY
-    )
+_session = _HopsworksSession()
+_model_cache = ModelCache(config.MODEL_CACHE_DIR)
+
+
+def get_hopsworks_project() -> "hopsworks.project.Project":
+    return _session.project()
+
+
+def get_feature_store() -> "FeatureStore":
+    return _session.feature_store()
+
+
+def get_model_registry():
+    return _session.model_registry()
+
+
+def reset_hopsworks_session():
+    """Drops the cached Hopsworks handles; the next call logs in again."""
+    _session.reset()
+
+
+def get_hopsworks_session_stats() -> dict:
+    """
+    Login counters of the shared session: number of logins, time spent
+    logging in, number of handle reuses, number of reconnects after a
+    connection or authentication error, and the estimated login time the
+    reuses avoided.
+    """
+    return _session.stats()
+
+
+# Model of the current inference worker process, set once by _init_worker()
+_worker_model = None
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
 
+def _predict_shard(features: pd.DataFrame) -> np.ndarray:
+    return _worker_model.predict(features)
 
-def get_feature_store() -> FeatureStore:
-    project = get_hopsworks_project()
-    return project.get_feature_store()
 
+def _station_shards(features: pd.DataFrame, chunk_size: int) -> list:
+    """
+    Splits `features` (rows grouped by station) into consecutive shards of
+    about `chunk_size` rows that never split a station.
+    """
+    station_ids = features["start_station_id"].to_numpy()
+    station_starts = np.flatnonzero(np.r_[True, station_ids[1:] != station_ids[:-1]])
+    bounds = np.unique(station_starts[np.searchsorted(station_starts, np.arange(0, len(features), chunk_size))])
+    bounds = np.append(bounds, len(features))
+    return [features.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
 
-def get_model_predictions(model, features: pd.DataFrame) -> pd.DataFrame:
-    # past_rides_columns = [c for c in features.columns if c.startswith('rides_')]
-    predictions = model.predict(features)
+
+def get_model_predictions(
+    model, features: pd.DataFrame, n_workers: int = 1, chunk_size: int = None
+) -> pd.DataFrame:
+    """
+    Predicts the demand of every station in `features`.
+
+    With `n_workers` > 1 the stations are split into shards of about
+    `chunk_size` rows (by default one shard per worker) and predicted by a
+    process pool. The model is sent to each worker once, when it starts,
+    and the shard results are merged back in station order.
+
+    A multi-horizon model (one prediction column per hour ahead, see
+    pipeline_utils.MultiHorizonRegressor) gives one row per station and
+    hour ahead, with its `horizon` (1 for the first hour).
+    """
+    # Works on both the default and the compact (dtype=...) window frames;
+    # the lag block is handed to the model as-is.
+    if n_workers > 1 and len(features) > 1:
+        chunk_size = chunk_size or -(-len(features) // n_workers)
+        shards = _station_shards(features, chunk_size)
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker, initargs=(model,)
+        ) as executor:
+            predictions = np.concatenate(list(executor.map(_predict_shard, shards)))
+    else:
+        predictions = model.predict(features)
+    # Station ids are stored as strings, also when the compact frames hold
+    # them as a categorical
+    station_ids = features["start_station_id"].astype(str).to_numpy()
     results = pd.DataFrame()
-    results["pickup_location_id"] = features["pickup_location_id"].values
+    if predictions.ndim == 2:
+        n_stations, horizon = predictions.shape
+        results["start_station_id"] = np.repeat(station_ids, horizon)
+        results["horizon"] = np.tile(np.arange(1, horizon + 1), n_stations)
+        results["predicted_demand"] = predictions.ravel().round(0)
+        return results
+
+    results["start_station_id"] = station_ids
     results["predicted_demand"] = predictions.round(0)
 
     return results
@@ -32,7 +215,15 @@ def get_model_predictions(model, features: pd.DataFrame) -> pd.DataFrame:
 
 def load_batch_of_features_from_store(
     current_date: datetime,
+    dtype=None,
+    lags=None,
 ) -> pd.DataFrame:
+    """
+    Returns one 672-lag feature row per station, built from the most recent
+    28 days, for predicting the hour starting at `current_date`. Pass a
+    pruned model's `pipeline_utils.model_lags()` as `lags` to build only
+    the lag columns it reads.
+    """
     feature_store = get_feature_store()
 
     # read time-series data from the feature store
@@ -47,43 +238,64 @@ def load_batch_of_features_from_store(
         start_time=(fetch_data_from - timedelta(days=1)),
         end_time=(fetch_data_to + timedelta(days=1)),
     )
-    ts_data = ts_data[ts_data.pickup_hour.between(fetch_data_from, fetch_data_to)]
+    ts_data = ts_data[ts_data.start_hour.between(fetch_data_from, fetch_data_to)]
 
     # Sort data by location and time
-    ts_data.sort_values(by=["pickup_location_id", "pickup_hour"], inplace=True)
+    ts_data.sort_values(by=["start_station_id", "start_hour"], inplace=True)
 
-    features = transform_ts_data_info_features(
-        ts_data, window_size=24 * 28, step_size=23
+    features = transform_ts_data_latest_window_bike(
+        ts_data, window_size=24 * 28, dtype=dtype, lags=lags
     )
 
     return features
 
 
-def load_model_from_registry(version=None):
-    from pathlib import Path
-
-    import joblib
-
+def load_model_from_registry(version=None, name=None):
+    """
+    Loads the registered model `name` (by default the next-hour model
+    config.MODEL_NAME), the latest version unless `version` is given.
+    Models are served from the process-wide model cache; the registry is
+    only listed every few minutes and a version is downloaded once.
+    """
     from src.pipeline_utils import (  # Import custom classes/functions
         TemporalFeatureEngineer,
         average_rides_last_4_weeks,
     )
 
-    project = get_hopsworks_project()
-    model_registry = project.get_model_registry()
+    name = name or config.MODEL_NAME
+    model_registry = get_model_registry()
+    if version is None:
+        version = _model_cache.latest_version(model_registry, name)
 
-    models = model_registry.get_models(name=config.MODEL_NAME)
-    model = max(models, key=lambda model: model.version)
-    model_dir = model.download()
-    model = joblib.load(Path(model_dir) / "lgb_model.pkl")
+    return _model_cache.get(
+        name,
+        version,
+        download=lambda: model_registry.get_model(name=name, version=version).download(),
+    )
 
-    return model
+
+def get_model_cache_stats() -> dict:
+    """Hit/miss counters of the model cache used by load_model_from_registry()."""
+    return _model_cache.stats()
+
+
+def get_model_schema(features: pd.DataFrame, targets):
+    """
+    The input and output schema to register a model with. None with the
+    local backend, whose registry does not store schemas, so hsml is only
+    imported when registering with Hopsworks.
+    """
+    if config.FEATURE_STORE_BACKEND == "local":
+        return None
+    from hsml.model_schema import ModelSchema
+    from hsml.schema import Schema
+
+    return ModelSchema(input_schema=Schema(features), output_schema=Schema(targets))
 
 
 def load_metrics_from_registry(version=None):
 
-    project = get_hopsworks_project()
-    model_registry = project.get_model_registry()
+    model_registry = get_model_registry()
 
     models = model_registry.get_models(name=config.MODEL_NAME)
     model = max(models, key=lambda model: model.version)
@@ -91,23 +303,95 @@ def load_metrics_from_registry(version=None):
     return model.training_metrics
 
 
+def _prune_prediction_cache(prediction_hour: datetime):
+    """Deletes the cache files of hours up to `prediction_hour` (earlier commits included)."""
+    for path in config.PREDICTION_CACHE_DIR.glob("*.parquet"):
+        if path.stem.split("_")[0] <= f"{prediction_hour:%Y%m%d%H}":
+            path.unlink(missing_ok=True)
+
+
 def fetch_next_hour_predictions():
-    # Get current UTC time and round up to next hour
+    """
+    Reads the predictions for the hour in progress only: the hourly
+    inference run predicts the hour after the last closed one.
+
+    The lookup is keyed on the prediction hour: a local per-hour cache file
+    is used when present, otherwise a filtered read fetches just that hour
+    from the predictions feature group, so latency does not grow with the
+    prediction history. Cache files are also keyed on the feature group's
+    latest commit, so a rerun of the inference pipeline (new model or
+    backfilled features) invalidates them.
+    """
+    # Get current UTC time and round down to the hour in progress
     now = datetime.now(timezone.utc)
-    next_hour = (now + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    prediction_hour = now.replace(minute=0, second=0, microsecond=0)
 
     fs = get_feature_store()
     fg = fs.get_feature_group(name=config.FEATURE_GROUP_MODEL_PREDICTION, version=1)
-    df = fg.read()
-    # Then filter for next hour in the DataFrame
-    df = df[df["pickup_hour"] == next_hour]
+    latest_commit = max(fg.commit_details(limit=1), default=0)
+    cache_path = config.PREDICTION_CACHE_DIR / f"{prediction_hour:%Y%m%d%H}_{latest_commit}.parquet"
+    if cache_path.exists():
+        df = pd.read_parquet(cache_path)
+    else:
+        df = fg.filter(fg.prediction_hour == prediction_hour).read()
+        if not df.empty:
+            config.PREDICTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            _prune_prediction_cache(prediction_hour)
+            df.to_parquet(cache_path, index=False)
 
     print(f"Current UTC time: {now}")
-    print(f"Next hour: {next_hour}")
+    print(f"Prediction hour: {prediction_hour}")
     print(f"Found {len(df)} records")
     return df
 
 
+def write_forecast_predictions(predictions: pd.DataFrame, features: pd.DataFrame, current_date) -> pd.DataFrame:
+    """
+    Inserts the get_model_predictions() rows of a multi-horizon model into
+    the forecasts feature group as one batch. Horizon h of a station is the
+    hour h - 1 after the `start_hour` of its window in `features`, the
+    hour its first booster predicts, and every run overwrites the hours
+    earlier runs forecast.
+    """
+    start_hours = pd.DatetimeIndex(features["start_hour"])
+    if start_hours.tz is None:
+        start_hours = start_hours.tz_localize("Etc/UTC")
+    first_hours = pd.Series(start_hours, index=features["start_station_id"].astype(str).to_numpy())
+    predictions = predictions.assign(
+        prediction_hour=predictions["start_station_id"].astype(str).map(first_hours)
+        + pd.to_timedelta(predictions["horizon"] - 1, unit="h"),
+        issued_hour=pd.Timestamp(current_date).floor("h"),
+    )
+    forecast_fg = get_feature_store().get_or_create_feature_group(
+        name=config.FEATURE_GROUP_MODEL_FORECAST,
+        version=1,
+        description="CitiBike multi-horizon demand forecasts",
+        primary_key=["start_station_id", "prediction_hour"],
+        event_time="prediction_hour",
+    )
+    forecast_fg.insert(predictions, write_options={"wait_for_job": False})
+    return predictions
+
+
+def fetch_forecast_predictions(horizon=None, current_date=None):
+    """
+    Reads the forecasts of the multi-horizon inference run for `horizon`
+    hours (config.FORECAST_HORIZON by default) from the hour in progress at
+    `current_date` (now by default) in one filtered read: one row per
+    station and hour, with the `horizon` it was predicted at and the
+    `issued_hour` of the run.
+    """
+    horizon = horizon or config.FORECAST_HORIZON
+    current_date = pd.Timestamp.now(tz="Etc/UTC") if current_date is None else pd.Timestamp(current_date)
+    first_hour = current_date.floor("h")
+    last_hour = first_hour + timedelta(hours=horizon - 1)
+
+    fs = get_feature_store()
+    fg = fs.get_feature_group(name=config.FEATURE_GROUP_MODEL_FORECAST, version=1)
+    df = fg.filter((fg.prediction_hour >= first_hour) & (fg.prediction_hour <= last_hour)).read()
+    return df.sort_values(["prediction_hour", "start_station_id"]).reset_index(drop=True)
+
+
 def fetch_predictions(hours):
     current_hour = (pd.Timestamp.now(tz="Etc/UTC") - timedelta(hours=hours)).floor("h")
 
@@ -119,19 +403,31 @@ def fetch_predictions(hours):
     return df
 
 
-def fetch_hourly_rides(hours):
-    current_hour = (pd.Timestamp.now(tz="Etc/UTC") - timedelta(hours=hours)).floor("h")
+def fetch_hourly_rides(hours, columns=None):
+    """
+    Reads the last `hours` hours of bike_hourly_fg. Both time bounds are
+    pushed into the feature store query; pass `columns` to read only those
+    features instead of the ~690 stored ones.
+    """
+    now = pd.Timestamp.now(tz="Etc/UTC")
+    current_hour = (now - timedelta(hours=hours)).floor("h")
 
     fs = get_feature_store()
     fg = fs.get_feature_group(name=config.FEATURE_GROUP_NAME, version=1)
 
-    query = fg.select_all()
-    query = query.filter(fg.pickup_hour >= current_hour)
+    query = fg.select(columns) if columns else fg.select_all()
+    query = query.filter((fg.start_hour >= current_hour) & (fg.start_hour <= now))
 
     return query.read()
 
 
-def fetch_days_data(days):
+def fetch_days_data(days, columns=None):
+    """
+    Reads `days` days of bike_hourly_fg ending one year ago. Both time bounds
+    are pushed into the feature store query; pass `columns` (e.g.
+    ["start_station_id", "start_hour", "rides"]) to skip the precomputed lag
+    columns.
+    """
     current_date = pd.to_datetime(datetime.now(timezone.utc))
     fetch_data_from = current_date - timedelta(days=(365 + days))
     fetch_data_to = current_date - timedelta(days=365)
@@ -139,8 +435,6 @@ def fetch_days_data(days):
     fs = get_feature_store()
     fg = fs.get_feature_group(name=config.FEATURE_GROUP_NAME, version=1)
 
-    query = fg.select_all()
-    # query = query.filter((fg.pickup_hour >= fetch_data_from))
-    df = query.read()
-    cond = (df["pickup_hour"] >= fetch_data_from) & (df["pickup_hour"] <= fetch_data_to)
-    return df[cond]
+    query = fg.select(columns) if columns else fg.select_all()
+    query = query.filter((fg.start_hour >= fetch_data_from) & (fg.start_hour <= fetch_data_to))
+    return query.read()
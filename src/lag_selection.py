@@ -0,0 +1,83 @@
+"""
+lag_selection.py – importance-driven pruning of the 672 `rides_t-*` lags.
+
+A booster is trained on the model input up to a validation week and early
+stopped on it; the lags are then ranked by their total split gain in that
+booster. The `top_k` best lags are kept, together with the four weekly lags
+`average_rides_last_4_weeks` needs. The kept lags are saved with the model
+(`lag_columns.json`), and `pipeline_utils.model_lags()` recovers them from
+any fitted model, so the window builders, the feature pipeline and
+inference only build the columns the model reads.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from src.dataset_cache import DATASET_PARAMETERS
+from src.tuning import tuning_split
+
+# Lags average_rides_last_4_weeks() averages; they are always kept
+REQUIRED_LAGS = (7 * 24, 14 * 24, 21 * 24, 28 * 24)
+
+
+def rank_lags_by_gain(
+    model_input,
+    targets,
+    feature_names,
+    start_hours,
+    params: Dict,
+    valid_days: int = 7,
+    holdout_days: int = 7,
+    feature_col: str = "rides",
+) -> pd.Series:
+    """
+    Total gain of every `<feature_col>_t-*` column of the time-sorted
+    `model_input`, highest first, in a booster trained on the rows before
+    the validation week (see tuning.tuning_split()) and early stopped on it.
+    """
+    valid_start, valid_stop = tuning_split(start_hours, valid_days, holdout_days)
+    train = lgb.Dataset(
+        model_input[:valid_start],
+        label=np.asarray(targets[:valid_start]),
+        feature_name=list(feature_names),
+        params=DATASET_PARAMETERS,
+    )
+    valid = lgb.Dataset(
+        model_input[valid_start:valid_stop],
+        label=np.asarray(targets[valid_start:valid_stop]),
+        reference=train,
+    )
+
+    params = {"verbose": -1, **params}
+    num_boost_round = params.pop("n_estimators", 100)
+    booster = lgb.train(
+        params,
+        train,
+        num_boost_round=num_boost_round,
+        valid_sets=[valid],
+        callbacks=[lgb.early_stopping(50, verbose=False)],
+    )
+
+    gain = pd.Series(
+        booster.feature_importance("gain", iteration=booster.best_iteration), index=list(feature_names)
+    )
+    return gain[gain.index.str.startswith(f"{feature_col}_t-")].sort_values(ascending=False)
+
+
+def select_lags(lag_gain: pd.Series, top_k: int, required=REQUIRED_LAGS) -> List[int]:
+    """The lags of the `top_k` highest-gain columns plus `required`, oldest first."""
+    top_lags = {int(name.rsplit("-", 1)[1]) for name in lag_gain.index[:top_k]}
+    return sorted(top_lags | set(required), reverse=True)
+
+
+def save_lag_columns(lags, path, feature_col: str = "rides") -> Path:
+    path = Path(path)
+    path.write_text(
+        json.dumps({"lags": list(map(int, lags)), "columns": [f"{feature_col}_t-{lag}" for lag in lags]}, indent=2)
+    )
+    return path
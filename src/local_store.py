@@ -0,0 +1,446 @@
+"""
+local_store.py – file-backed stand-in for the Hopsworks project API.
+
+Set `FEATURE_STORE_BACKEND=local` and every helper in `src.inference` (and
+therefore the feature, inference and training pipelines) reads and writes
+Parquet files under `LOCAL_FEATURE_STORE_DIR` instead of calling Hopsworks:
+```python
+project = LocalProject("data/local_store")
+fs = project.get_feature_store()
+fg = fs.get_or_create_feature_group(name="bike_hourly_fg", version=1,
+                                    primary_key=["start_station_id", "start_hour"],
+                                    event_time="start_hour")
+fg.insert(df)
+fg.filter(fg.start_hour >= start).read()
+```
+
+Only the subset of the Hopsworks API this project uses is implemented:
+feature groups (`insert`, `read`, `select`, `select_all`, `filter`,
+`commit_details`), feature
+views (`get_batch_data`), the model registry (`get_models`, `get_model`,
+`sklearn.create_model`, `save`, `download`) and the dataset API (`exists`,
+`upload`, `download`).
+
+Feature groups are stored as Parquet datasets partitioned by the date of
+their event time (`date=YYYY-MM-DD/`), so time-range filters only open the
+partitions they can match.
+"""
+
+import json
+import operator
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+_PARTITION_COLUMN = "date"
+_PARTITIONING = ds.partitioning(pa.schema([(_PARTITION_COLUMN, pa.string())]), flavor="hive")
+
+_OPERATORS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+# --------------------------------------------------------------------------- #
+# Filter expressions (fg.start_hour >= t) & (fg.start_hour < u)
+# --------------------------------------------------------------------------- #
+
+class Feature:
+    """A feature group column, usable in filter expressions."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _compare(self, op: str, value: Any) -> "Filter":
+        return Filter([(self.name, op, value)])
+
+    def __ge__(self, value):
+        return self._compare(">=", value)
+
+    def __gt__(self, value):
+        return self._compare(">", value)
+
+    def __le__(self, value):
+        return self._compare("<=", value)
+
+    def __lt__(self, value):
+        return self._compare("<", value)
+
+    def __eq__(self, value):
+        return self._compare("==", value)
+
+    def __ne__(self, value):
+        return self._compare("!=", value)
+
+    def isin(self, values):
+        return self._compare("isin", list(values))
+
+    __hash__ = object.__hash__
+
+
+class Filter:
+    """Conjunction of `(column, operator, value)` conditions."""
+
+    def __init__(self, conditions: List[tuple]):
+        self.conditions = conditions
+
+    def __and__(self, other: "Filter") -> "Filter":
+        return Filter(self.conditions + other.conditions)
+
+
+def _utc_dates(values) -> pd.Series:
+    """YYYY-MM-DD partition names of event times, taken in UTC."""
+    values = pd.to_datetime(pd.Series(values))
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert("UTC")
+    return values.dt.strftime("%Y-%m-%d")
+
+
+def _as_column_value(value, field_type):
+    """Converts a filter value to the type and timezone of the column."""
+    if pa.types.is_timestamp(field_type):
+        value = pd.Timestamp(value)
+        if field_type.tz is None and value.tzinfo is not None:
+            value = value.tz_convert("UTC").tz_localize(None)
+        elif field_type.tz is not None and value.tzinfo is None:
+            value = value.tz_localize("UTC")
+        return pa.scalar(value, type=field_type)
+    return value
+
+
+# --------------------------------------------------------------------------- #
+# Feature groups, queries and feature views
+# --------------------------------------------------------------------------- #
+
+class LocalQuery:
+    """Column projection plus filters over one feature group."""
+
+    def __init__(self, feature_group: "LocalFeatureGroup", columns=None, filters=None):
+        self._feature_group = feature_group
+        self._columns = columns
+        self._filter = filters or Filter([])
+
+    def filter(self, condition: Filter) -> "LocalQuery":
+        return LocalQuery(self._feature_group, self._columns, self._filter & condition)
+
+    def read(self, **kwargs) -> pd.DataFrame:
+        return self._feature_group._scan(self._columns, self._filter)
+
+
+class LocalFeatureGroup:
+    """A feature group stored as a date-partitioned Parquet dataset."""
+
+    def __init__(self, path: Path, metadata: Dict[str, Any]):
+        self._path = path
+        self._metadata = metadata
+        self.name = metadata["name"]
+        self.version = metadata["version"]
+        self.primary_key = metadata["primary_key"]
+        self.event_time = metadata["event_time"]
+
+    def __getattr__(self, name: str) -> Feature:
+        # fg.<column> builds filter expressions, like in hsfs
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return Feature(name)
+
+    # ---- writes ----------------------------------------------------------
+    def insert(self, df: pd.DataFrame, write_options: Optional[Dict] = None, **kwargs):
+        """
+        Upserts `df` on the primary key. Only the date partitions touched
+        by `df` are rewritten.
+        """
+        if df.empty:
+            return
+        dates = _utc_dates(df[self.event_time])
+        for date, new_rows in df.groupby(dates.to_numpy()):
+            partition_dir = self._path / f"{_PARTITION_COLUMN}={date}"
+            if partition_dir.exists():
+                existing = pd.read_parquet(partition_dir)
+                new_rows = pd.concat([existing, new_rows], ignore_index=True)
+                new_rows = new_rows.drop_duplicates(subset=self.primary_key, keep="last")
+                shutil.rmtree(partition_dir)
+            partition_dir.mkdir(parents=True)
+            new_rows.reset_index(drop=True).to_parquet(
+                partition_dir / f"part-{uuid.uuid4().hex}.parquet", index=False
+            )
+        self._record_commit(len(df))
+
+    def _record_commit(self, n_rows: int):
+        # Commit ids are epoch milliseconds, kept increasing like Hudi's
+        commits = self._metadata.setdefault("commits", [])
+        commit_id = max(int(time.time() * 1000), commits[-1]["commit_id"] + 1 if commits else 0)
+        committed_on = pd.Timestamp(commit_id, unit="ms").strftime("%Y%m%d%H%M%S%f")[:-3]
+        commits.append({"commit_id": commit_id, "committedOn": committed_on, "rowsInserted": n_rows})
+        (self._path / "_metadata.json").write_text(json.dumps(self._metadata))
+
+    def commit_details(self, wallclock_time=None, limit: Optional[int] = None) -> Dict[int, Dict[str, Any]]:
+        """Commits to this feature group by id, newest first, like hsfs."""
+        commits = self._metadata.get("commits", [])[::-1]
+        if limit is not None:
+            commits = commits[:limit]
+        return {
+            commit["commit_id"]: {key: value for key, value in commit.items() if key != "commit_id"}
+            for commit in commits
+        }
+
+    # ---- reads -----------------------------------------------------------
+    def select_all(self) -> LocalQuery:
+        return LocalQuery(self)
+
+    def select(self, columns: List[str]) -> LocalQuery:
+        return LocalQuery(self, columns=list(columns))
+
+    def filter(self, condition: Filter) -> LocalQuery:
+        return LocalQuery(self).filter(condition)
+
+    def read(self, **kwargs) -> pd.DataFrame:
+        return self._scan(None, Filter([]))
+
+    def _scan(self, columns, condition: Filter) -> pd.DataFrame:
+        if not any(self._path.glob(f"{_PARTITION_COLUMN}=*")):
+            return pd.DataFrame(columns=columns)
+
+        dataset = ds.dataset(self._path, format="parquet", partitioning=_PARTITIONING)
+        expression = None
+        for name, op, value in condition.conditions:
+            field_type = dataset.schema.field(name).type
+            if op == "isin":
+                term = ds.field(name).isin([_as_column_value(v, field_type) for v in value])
+            else:
+                term = _OPERATORS[op](ds.field(name), _as_column_value(value, field_type))
+                if name == self.event_time:
+                    term = term & self._partition_bound(op, value)
+            expression = term if expression is None else expression & term
+
+        if columns is None:
+            columns = [name for name in dataset.schema.names if name != _PARTITION_COLUMN]
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    @staticmethod
+    def _partition_bound(op: str, value) -> ds.Expression:
+        """Date-partition condition implied by an event-time condition."""
+        date = _utc_dates([value]).iloc[0]
+        field = ds.field(_PARTITION_COLUMN)
+        if op in (">=", ">"):
+            return field >= date
+        if op in ("<=", "<"):
+            return field <= date
+        if op == "==":
+            return field == date
+        return ds.scalar(True)
+
+
+class LocalFeatureView:
+    """A named query over a feature group."""
+
+    def __init__(self, name: str, version: int, query: LocalQuery):
+        self.name = name
+        self.version = version
+        self.query = query
+
+    def get_batch_data(self, start_time=None, end_time=None, **kwargs) -> pd.DataFrame:
+        feature_group = self.query._feature_group
+        query = self.query
+        event_time = Feature(feature_group.event_time)
+        if start_time is not None:
+            query = query.filter(event_time >= start_time)
+        if end_time is not None:
+            query = query.filter(event_time < end_time)
+        return query.read()
+
+
+class LocalFeatureStore:
+    def __init__(self, root: Path):
+        self._root = Path(root)
+
+    def _feature_group_path(self, name: str, version: int) -> Path:
+        return self._root / "feature_groups" / f"{name}_{version}"
+
+    def get_feature_group(self, name: str, version: int = 1) -> LocalFeatureGroup:
+        path = self._feature_group_path(name, version)
+        metadata_path = path / "_metadata.json"
+        if not metadata_path.exists():
+            raise FileNotFoundError(f"Feature group {name} (v{version}) does not exist in {self._root}")
+        return LocalFeatureGroup(path, json.loads(metadata_path.read_text()))
+
+    def get_or_create_feature_group(
+        self, name: str, version: int = 1, primary_key=None, event_time=None, description="", **kwargs
+    ) -> LocalFeatureGroup:
+        path = self._feature_group_path(name, version)
+        if not (path / "_metadata.json").exists():
+            path.mkdir(parents=True, exist_ok=True)
+            metadata = {
+                "name": name,
+                "version": version,
+                "primary_key": list(primary_key or []),
+                "event_time": event_time,
+                "description": description,
+            }
+            (path / "_metadata.json").write_text(json.dumps(metadata))
+        return self.get_feature_group(name, version)
+
+    def _feature_view_path(self, name: str, version: int) -> Path:
+        return self._root / "feature_views" / f"{name}_{version}.json"
+
+    def get_or_create_feature_view(self, name: str, version: int = 1, query: LocalQuery = None, **kwargs):
+        path = self._feature_view_path(name, version)
+        if not path.exists():
+            feature_group = query._feature_group
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(
+                json.dumps(
+                    {
+                        "feature_group": feature_group.name,
+                        "feature_group_version": feature_group.version,
+                        "columns": query._columns,
+                    }
+                )
+            )
+        return self.get_feature_view(name, version)
+
+    def get_feature_view(self, name: str, version: int = 1) -> LocalFeatureView:
+        path = self._feature_view_path(name, version)
+        if path.exists():
+            metadata = json.loads(path.read_text())
+            feature_group = self.get_feature_group(metadata["feature_group"], metadata["feature_group_version"])
+            return LocalFeatureView(name, version, LocalQuery(feature_group, metadata["columns"]))
+
+        # Without a stored definition, a view is taken to select all of the
+        # feature group it is named after (bike_hourly_fv -> bike_hourly_fg)
+        feature_group = self.get_feature_group(name.replace("_fv", "_fg"), version)
+        return LocalFeatureView(name, version, feature_group.select_all())
+
+
+# --------------------------------------------------------------------------- #
+# Model registry
+# --------------------------------------------------------------------------- #
+
+class LocalModel:
+    def __init__(self, root: Path, name: str, version: int, training_metrics=None, description=""):
+        self._root = root
+        self.name = name
+        self.version = version
+        self.training_metrics = training_metrics or {}
+        self.description = description
+
+    @property
+    def _path(self) -> Path:
+        return self._root / self.name / str(self.version)
+
+    def save(self, model_path: str, **kwargs) -> "LocalModel":
+        """Copies the model file or directory into the registry."""
+        model_path = Path(model_path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        if model_path.is_dir():
+            shutil.copytree(model_path, self._path, dirs_exist_ok=True)
+        else:
+            shutil.copy2(model_path, self._path / model_path.name)
+        (self._path / "_metadata.json").write_text(
+            json.dumps({"training_metrics": self.training_metrics, "description": self.description})
+        )
+        return self
+
+    def download(self, local_path: Optional[str] = None) -> str:
+        if local_path is None:
+            return str(self._path)
+        shutil.copytree(self._path, local_path, dirs_exist_ok=True)
+        return str(local_path)
+
+
+class _ModelFactory:
+    """Stands in for `model_registry.sklearn` / `.python`."""
+
+    def __init__(self, registry: "LocalModelRegistry"):
+        self._registry = registry
+
+    def create_model(self, name: str, metrics=None, description="", **kwargs) -> LocalModel:
+        versions = [model.version for model in self._registry.get_models(name)]
+        version = max(versions, default=0) + 1
+        return LocalModel(self._registry._root, name, version, metrics, description)
+
+
+class LocalModelRegistry:
+    def __init__(self, root: Path):
+        self._root = Path(root) / "models"
+        self.sklearn = _ModelFactory(self)
+        self.python = _ModelFactory(self)
+
+    def get_models(self, name: str) -> List[LocalModel]:
+        models = []
+        for metadata_path in (self._root / name).glob("*/_metadata.json"):
+            metadata = json.loads(metadata_path.read_text())
+            version = int(metadata_path.parent.name)
+            models.append(
+                LocalModel(self._root, name, version, metadata["training_metrics"], metadata["description"])
+            )
+        return sorted(models, key=lambda model: model.version)
+
+    def get_model(self, name: str, version: Optional[int] = None) -> LocalModel:
+        models = self.get_models(name)
+        if not models:
+            raise FileNotFoundError(f"Model {name} does not exist in {self._root}")
+        if version is None:
+            return models[-1]
+        for model in models:
+            if model.version == version:
+                return model
+        raise FileNotFoundError(f"Model {name} (v{version}) does not exist in {self._root}")
+
+
+# --------------------------------------------------------------------------- #
+# Dataset API and project
+# --------------------------------------------------------------------------- #
+
+class LocalDatasetApi:
+    """Maps Hopsworks dataset paths (e.g. Resources/...) to local files."""
+
+    def __init__(self, root: Path):
+        self._root = Path(root) / "datasets"
+
+    def exists(self, path: str) -> bool:
+        return (self._root / path).exists()
+
+    def download(self, path: str, local_path: Optional[str] = None, overwrite: bool = False, **kwargs) -> str:
+        source = self._root / path
+        target = Path(local_path or source.name)
+        if target.exists() and not overwrite:
+            raise FileExistsError(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source, target)
+        return str(target)
+
+    def upload(self, local_path: str, upload_path: str, overwrite: bool = False, **kwargs) -> str:
+        target = self._root / upload_path / Path(local_path).name
+        if target.exists() and not overwrite:
+            raise FileExistsError(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(local_path, target)
+        return str(target)
+
+
+class LocalProject:
+    """Offline replacement for the object returned by `hopsworks.login()`."""
+
+    def __init__(self, root):
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+
+    def get_feature_store(self) -> LocalFeatureStore:
+        return LocalFeatureStore(self._root)
+
+    def get_model_registry(self) -> LocalModelRegistry:
+        return LocalModelRegistry(self._root)
+
+    def get_dataset_api(self) -> LocalDatasetApi:
+        return LocalDatasetApi(self._root)
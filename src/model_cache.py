@@ -0,0 +1,123 @@
+"""
+model_cache.py – versioned on-disk + in-process cache for registry models.
+
+`load_model_from_registry()` goes through a `ModelCache`, so a warm load
+neither lists the registry, downloads the artifact nor unpickles it again:
+
+1. The latest registered version is looked up at most once every
+   `version_check_seconds`; in between, the last answer is reused.
+2. `(name, version)` is looked up in an in-process LRU of loaded models.
+3. Otherwise the artifact is loaded from `cache_dir/<name>/<version>/`,
+   after validating its SHA-256 checksum.
+4. Only when both miss is the model downloaded from the registry.
+"""
+
+import hashlib
+import json
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import joblib
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """Caches deserialized registry models keyed by model name and version."""
+
+    def __init__(
+        self,
+        cache_dir,
+        artifact_name: str = "lgb_model.pkl",
+        max_entries: int = 2,
+        version_check_seconds: float = 300.0,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.artifact_name = artifact_name
+        self.max_entries = max_entries
+        self.version_check_seconds = version_check_seconds
+        self._models: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._latest_versions: Dict[str, tuple] = {}
+        self._lock = threading.RLock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "registry_queries": 0}
+
+    # ---- version resolution ---------------------------------------------
+    def latest_version(self, model_registry, name: str) -> int:
+        """Latest registered version, re-queried at most every `version_check_seconds`."""
+        with self._lock:
+            checked_at, version = self._latest_versions.get(name, (None, None))
+            if checked_at is not None and time.monotonic() - checked_at < self.version_check_seconds:
+                return version
+
+            self._stats["registry_queries"] += 1
+            models = model_registry.get_models(name=name)
+            version = max(model.version for model in models)
+            self._latest_versions[name] = (time.monotonic(), version)
+            return version
+
+    # ---- loading ---------------------------------------------------------
+    def _artifact_path(self, name: str, version: int) -> Path:
+        return self.cache_dir / name / str(version) / self.artifact_name
+
+    def _load_from_disk(self, name: str, version: int) -> Optional[Any]:
+        artifact_path = self._artifact_path(name, version)
+        checksum_path = artifact_path.with_suffix(".sha256.json")
+        if not artifact_path.exists() or not checksum_path.exists():
+            return None
+        expected = json.loads(checksum_path.read_text())["sha256"]
+        if _sha256(artifact_path) != expected:
+            # Corrupt or partially written entry: drop it and download again
+            shutil.rmtree(artifact_path.parent, ignore_errors=True)
+            return None
+        return joblib.load(artifact_path)
+
+    def _store_on_disk(self, name: str, version: int, downloaded_dir: str) -> Path:
+        artifact_path = self._artifact_path(name, version)
+        artifact_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(Path(downloaded_dir) / self.artifact_name, artifact_path)
+        artifact_path.with_suffix(".sha256.json").write_text(
+            json.dumps({"sha256": _sha256(artifact_path)})
+        )
+        return artifact_path
+
+    def _remember(self, key: tuple, model: Any) -> Any:
+        self._models[key] = model
+        self._models.move_to_end(key)
+        while len(self._models) > self.max_entries:
+            self._models.popitem(last=False)
+        return model
+
+    def get(self, name: str, version: int, download: Callable[[], str]) -> Any:
+        """
+        Returns model `name` at `version`. `download` is only called on a
+        full miss and must return the directory holding the artifact.
+        """
+        key = (name, version)
+        with self._lock:
+            if key in self._models:
+                self._stats["memory_hits"] += 1
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model = self._load_from_disk(name, version)
+            if model is not None:
+                self._stats["disk_hits"] += 1
+                return self._remember(key, model)
+
+            self._stats["misses"] += 1
+            artifact_path = self._store_on_disk(name, version, download())
+            return self._remember(key, joblib.load(artifact_path))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, cached_in_memory=len(self._models))
@@ -1,12 +1,27 @@
 import lightgbm as lgb
+import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.base import BaseEstimator, RegressorMixin, TransformerMixin
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import FunctionTransformer
 
 
+def _with_columns(X: pd.DataFrame, new_columns: dict, drop=()) -> pd.DataFrame:
+    """
+    A shallow copy of `X` with `new_columns` added and `drop` removed. The
+    columns of `X` are shared, not copied (pd.concat would consolidate them
+    into a new block), and `X` itself is left untouched.
+    """
+    X_ = X.copy(deep=False)
+    for name, values in new_columns.items():
+        X_[name] = values
+    for name in drop:
+        del X_[name]
+    return X_
+
+
 # Function to calculate the average rides over the last 4 weeks
-def average_rides_last_4_weeks(X: pd.DataFrame) -> pd.DataFrame:
+def average_rides_last_4_weeks(X: pd.DataFrame, dtype=None) -> pd.DataFrame:
     last_4_weeks_columns = [
         f"rides_t-{7*24}",  # 1 week ago
         f"rides_t-{14*24}",  # 2 weeks ago
@@ -19,10 +34,13 @@ def average_rides_last_4_weeks(X: pd.DataFrame) -> pd.DataFrame:
         if col not in X.columns:
             raise ValueError(f"Missing required column: {col}")
 
-    # Calculate the average of the last 4 weeks
-    X["average_rides_last_4_weeks"] = X[last_4_weeks_columns].mean(axis=1)
+    # Calculate the average of the last 4 weeks from just those columns
+    average = X[last_4_weeks_columns].mean(axis=1)
+    if dtype is not None:
+        average = average.astype(dtype)
 
-    return X
+    # Added to a shallow copy instead of written into the caller's frame
+    return _with_columns(X, {"average_rides_last_4_weeks": average})
 
 
 # FunctionTransformer to add the average rides feature
@@ -31,16 +49,37 @@ add_feature_average_rides_last_4_weeks = FunctionTransformer(
 )
 
 
+# Function to keep only the lag columns a pruned model was trained on
+def select_lag_columns(X: pd.DataFrame, lag_columns=()) -> pd.DataFrame:
+    lag_columns = list(lag_columns)
+    other_columns = [col for col in X.columns if not col.startswith("rides_t-")]
+    if [col for col in X.columns if col.startswith("rides_t-")] == lag_columns:
+        # Already pruned (e.g. inference windows built with the model's lags)
+        return X
+    # Only the kept lag columns are copied
+    return X[lag_columns + other_columns].copy(deep=False)
+
+
 # Custom transformer to add temporal features
 class TemporalFeatureEngineer(BaseEstimator, TransformerMixin):
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+
     def fit(self, X, y=None):
         return self
 
     def transform(self, X, y=None):
-        X_ = X.copy()
-        X_["hour"] = X_["start_hour"].dt.hour
-        X_["day_of_week"] = X_["start_hour"].dt.dayofweek
-        return X_.drop(columns=["start_hour", "start_station_id"])
+        # Models pickled before `dtype` existed are restored without it
+        dtype = getattr(self, "dtype", None)
+        hour = X["start_hour"].dt.hour
+        day_of_week = X["start_hour"].dt.dayofweek
+        if dtype is not None:
+            hour, day_of_week = hour.astype(dtype), day_of_week.astype(dtype)
+        return _with_columns(
+            X,
+            {"hour": hour, "day_of_week": day_of_week},
+            drop=["start_hour", "start_station_id"],
+        )
 
 
 # Instantiate the temporal feature engineer
@@ -48,12 +87,19 @@ add_temporal_features = TemporalFeatureEngineer()
 
 
 # Function to return the pipeline
-def get_pipeline(**hyper_params):
+def get_pipeline(feature_dtype=None, lag_columns=None, **hyper_params):
     """
     Returns a pipeline with optional parameters for LGBMRegressor.
 
     Parameters:
     ----------
+    feature_dtype : str or numpy dtype, optional
+        Dtype of the compact lag matrix produced by the window builders
+        (e.g. "float32"). The derived features are cast to it so LightGBM
+        receives a single homogeneous matrix.
+    lag_columns : list of str, optional
+        The `rides_t-*` columns to keep, e.g. from lag_selection. Other lag
+        columns in the input are dropped before the feature steps.
     **hyper_params : dict
         Optional parameters to pass to the LGBMRegressor.
 
@@ -62,9 +108,234 @@ def get_pipeline(**hyper_params):
     pipeline : sklearn.pipeline.Pipeline
         A pipeline with feature engineering and LGBMRegressor.
     """
-    pipeline = make_pipeline(
-        add_feature_average_rides_last_4_weeks,
-        add_temporal_features,
-        lgb.LGBMRegressor(**hyper_params),  # Pass optional parameters here
-    )
+    if feature_dtype is None:
+        average_step = add_feature_average_rides_last_4_weeks
+        temporal_step = add_temporal_features
+    else:
+        average_step = FunctionTransformer(
+            average_rides_last_4_weeks,
+            validate=False,
+            kw_args={"dtype": feature_dtype},
+        )
+        temporal_step = TemporalFeatureEngineer(dtype=feature_dtype)
+
+    steps = [average_step, temporal_step, lgb.LGBMRegressor(**hyper_params)]  # Pass optional parameters here
+    if lag_columns is not None:
+        steps.insert(
+            0,
+            FunctionTransformer(select_lag_columns, validate=False, kw_args={"lag_columns": list(lag_columns)}),
+        )
+    pipeline = make_pipeline(*steps)
     return pipeline
+
+
+def write_model_input(pipeline, windows, model_input_path, chunk_rows=50_000):
+    """
+    Applies the feature steps of a get_pipeline() pipeline to windows opened
+    with data_utils.load_ts_windows_memmap(), chunk by chunk, and writes
+    their float32 output to a memory-mapped matrix at `model_input_path`.
+
+    The feature steps are stateless, so this only fits them on the first
+    chunk. Returns the model input matrix and its column names.
+    """
+    from src.data_utils import ts_windows_frame
+
+    transformers = pipeline[:-1]
+    n_rows = len(windows["targets"])
+
+    first_chunk, _ = ts_windows_frame(windows, slice(0, min(chunk_rows, n_rows)))
+    sample = transformers.fit_transform(first_chunk)
+    model_input = np.lib.format.open_memmap(
+        model_input_path, mode="w+", dtype=np.float32, shape=(n_rows, sample.shape[1])
+    )
+    for start in range(0, n_rows, chunk_rows):
+        chunk, _ = ts_windows_frame(windows, slice(start, start + chunk_rows))
+        model_input[start : start + len(chunk)] = transformers.transform(chunk).to_numpy(dtype=np.float32)
+    model_input.flush()
+    return model_input, list(sample.columns)
+
+
+class BoosterRegressor(BaseEstimator, RegressorMixin):
+    """
+    Final pipeline step training a booster with lightgbm.train(), so it
+    can be fitted on an already constructed (e.g. cached) lightgbm Dataset.
+    `params` are LGBMRegressor parameters and the fitted booster is exposed
+    as `booster_`, like LGBMRegressor does.
+    """
+
+    def __init__(self, params=None):
+        self.params = params
+
+    def fit(self, X, y=None, feature_name="auto", init_model=None):
+        """
+        Trains on `X` and `y`, or on the lightgbm Dataset `X`. With
+        `init_model` (a Booster) its trees are kept and `n_estimators` more
+        are boosted on top of them.
+        """
+        dataset = X if isinstance(X, lgb.Dataset) else lgb.Dataset(X, label=y, feature_name=feature_name)
+        params = {"verbose": -1, **(self.params or {})}
+        num_boost_round = params.pop("n_estimators", 100)
+        self.booster_ = lgb.train(params, dataset, num_boost_round=num_boost_round, init_model=init_model)
+        return self
+
+    def predict(self, X):
+        return self.booster_.predict(X)
+
+
+class MultiHorizonRegressor(BaseEstimator, RegressorMixin):
+    """
+    Final pipeline step of a multi-horizon forecaster: one direct booster
+    per hour ahead, trained with lightgbm.train() on the same binned
+    Dataset, so the model input is binned once for all horizons.
+
+    `fit()` takes the (n_rows, horizon) targets of the window builders'
+    `horizon` mode and `predict()` returns one column per hour ahead.
+    `boosters_[0]` predicts the first hour and is also exposed as
+    `booster_`, like BoosterRegressor.
+    """
+
+    def __init__(self, params=None):
+        self.params = params
+
+    def fit(self, X, y, feature_name="auto"):
+        from src.dataset_cache import DATASET_PARAMETERS
+
+        targets = np.asarray(y)
+        dataset = lgb.Dataset(X, label=targets[:, 0], feature_name=feature_name, params=DATASET_PARAMETERS)
+        dataset.construct()
+        params = {"verbose": -1, **(self.params or {})}
+        num_boost_round = params.pop("n_estimators", 100)
+
+        self.boosters_ = []
+        for h in range(targets.shape[1]):
+            dataset.set_label(targets[:, h])
+            self.boosters_.append(lgb.train(params, dataset, num_boost_round=num_boost_round))
+        return self
+
+    @property
+    def booster_(self):
+        return self.boosters_[0]
+
+    def predict(self, X):
+        return np.column_stack([booster.predict(X) for booster in self.boosters_])
+
+
+class LeanPredictor:
+    """
+    Inference-only replacement for a fitted get_pipeline() pipeline.
+
+    Builds the model input as one float32 matrix with NumPy (lag columns
+    gathered by precomputed positions, the 4-week average and the
+    hour/day-of-week derivation done in place) and calls the LightGBM
+    booster directly. Ride counts and their quarter averages are exact in
+    float32, so predictions match the pipeline's exactly.
+
+    With `horizon_boosters` (a MultiHorizonRegressor's boosters) the model
+    input is built once and `predict()` returns one column per hour ahead.
+    """
+
+    def __init__(self, booster, feature_names, average_columns, time_column="start_hour", horizon_boosters=None):
+        self.booster = booster
+        self.horizon_boosters = horizon_boosters
+        self.feature_names = list(feature_names)
+        self.time_column = time_column
+
+        position = {name: i for i, name in enumerate(self.feature_names)}
+        self._average_position = position["average_rides_last_4_weeks"]
+        self._hour_position = position["hour"]
+        self._day_of_week_position = position["day_of_week"]
+        derived = {self._average_position, self._hour_position, self._day_of_week_position}
+        self._input_positions = np.array(
+            [i for i in range(len(self.feature_names)) if i not in derived]
+        )
+        self._input_columns = [self.feature_names[i] for i in self._input_positions]
+        self._average_positions = np.array([position[name] for name in average_columns])
+        self._column_layout = None
+        self._column_indexer = None
+
+    def _input_indexer(self, X: pd.DataFrame) -> np.ndarray:
+        # Column positions are resolved once per input layout
+        layout = tuple(X.columns)
+        if layout != self._column_layout:
+            indexer = X.columns.get_indexer(self._input_columns)
+            if (indexer < 0).any():
+                missing = [c for c, i in zip(self._input_columns, indexer) if i < 0]
+                raise ValueError(f"Missing required columns: {missing}")
+            self._column_layout, self._column_indexer = layout, indexer
+        return self._column_indexer
+
+    def transform(self, X: pd.DataFrame) -> np.ndarray:
+        matrix = np.empty((len(X), len(self.feature_names)), dtype=np.float32)
+        matrix[:, self._input_positions] = X.iloc[:, self._input_indexer(X)].to_numpy(dtype=np.float32)
+        matrix[:, self._average_position] = matrix[:, self._average_positions].mean(axis=1)
+
+        times = X[self.time_column]
+        if times.dt.tz is not None:
+            times = times.dt.tz_localize(None)
+        hours = times.to_numpy(dtype="datetime64[ns]").astype("datetime64[h]").astype(np.int64)
+        matrix[:, self._hour_position] = hours % 24
+        # 1970-01-01 was a Thursday (day_of_week 3)
+        matrix[:, self._day_of_week_position] = (hours // 24 + 3) % 7
+        return matrix
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        matrix = self.transform(X)
+        if self.horizon_boosters is None:
+            return self.booster.predict(matrix)
+        return np.column_stack([booster.predict(matrix) for booster in self.horizon_boosters])
+
+
+def export_lean_predictor(pipeline) -> LeanPredictor:
+    """
+    Turns a fitted get_pipeline() pipeline, whose last step may be a
+    MultiHorizonRegressor, into a LeanPredictor.
+    """
+    booster = pipeline[-1].booster_
+    average_columns = [f"rides_t-{7*24}", f"rides_t-{14*24}", f"rides_t-{21*24}", f"rides_t-{28*24}"]
+    return LeanPredictor(
+        booster, booster.feature_name(), average_columns, horizon_boosters=getattr(pipeline[-1], "boosters_", None)
+    )
+
+
+def booster_parameters(booster) -> dict:
+    """
+    BoosterRegressor (or LGBMRegressor) parameters of a trained booster,
+    with `n_estimators` set to its number of trees, including any trees
+    inherited through `init_model`. The thread count and metrics are left
+    to the caller's environment.
+    """
+    params = {
+        name: value
+        for name, value in booster.params.items()
+        if name not in ("num_iterations", "num_threads", "metric")
+    }
+    params["n_estimators"] = booster.current_iteration()
+    return params
+
+
+def retrain_parameters(model) -> dict:
+    """
+    BoosterRegressor parameters of the last full retrain behind a fitted
+    get_pipeline() pipeline, e.g. to train a related model from scratch.
+
+    Warm-start updates (warm_start.py) keep the parameters of the model
+    they continue in `retrain_params_`, so `n_estimators` does not grow
+    with the trees they add. Models whose last step carries no parameters
+    (a plain LGBMRegressor) fall back to booster_parameters().
+    """
+    step = model[-1]
+    params = getattr(step, "retrain_params_", None) or getattr(step, "params", None)
+    if params is None:
+        return booster_parameters(step.booster_)
+    return dict(params)
+
+
+def model_lags(model, feature_col="rides") -> list:
+    """
+    The lags (hours before the predicted hour) a fitted get_pipeline()
+    pipeline or LeanPredictor consumes, oldest first. Pass them as `lags`
+    to the data_utils window builders to build only those columns.
+    """
+    booster = model.booster if isinstance(model, LeanPredictor) else model[-1].booster_
+    prefix = f"{feature_col}_t-"
+    return [int(name[len(prefix) :]) for name in booster.feature_name() if name.startswith(prefix)]
@@ -0,0 +1,224 @@
+"""
+tuning.py – parallel LightGBM hyperparameter search for the training pipeline.
+
+The training rows of the time-sorted model input are binned into a LightGBM
+Dataset once and saved with `save_binary()`, together with the validation
+rows binned against it. Every worker process loads those binary files once
+and reuses them for all of its trials, so the 675-column matrix is never
+re-binned.
+
+Trials run in `n_workers` processes sharing one Optuna study through a
+journal file. Each trial reports its validation MAE every `report_every`
+boosting rounds, and the median pruner stops trials that are worse than the
+median of earlier trials at the same round. The search ends after
+`n_trials` finished trials or at the `time_budget_s` deadline, whichever
+comes first; trials still running at the deadline are pruned.
+
+The validation week is the one before the newest `holdout_days`, so the
+week the backtest promotes on stays unseen by the search.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import lightgbm as lgb
+import numpy as np
+import optuna
+import pandas as pd
+from optuna.storages.journal import JournalFileBackend, JournalStorage
+
+from src.dataset_cache import DATASET_PARAMETERS
+
+STUDY_NAME = "citibike_lgbm"
+
+
+def _suggest_parameters(trial: optuna.Trial) -> Dict:
+    return {
+        "n_estimators": trial.suggest_int("n_estimators", 100, 1000),
+        "learning_rate": trial.suggest_float("learning_rate", 0.005, 0.2, log=True),
+        "num_leaves": trial.suggest_int("num_leaves", 31, 1024, log=True),
+        "max_depth": trial.suggest_int("max_depth", 3, 12),
+        "min_child_samples": trial.suggest_int("min_child_samples", 10, 200),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.3, 1.0),
+    }
+
+
+SEARCHED_PARAMETERS = (
+    "n_estimators",
+    "learning_rate",
+    "num_leaves",
+    "max_depth",
+    "min_child_samples",
+    "colsample_bytree",
+)
+
+
+def tuning_split(start_hours, valid_days: int = 7, holdout_days: int = 7) -> Tuple[int, int]:
+    """
+    Row range `(valid_start, valid_stop)` of the `valid_days` before the
+    newest `holdout_days` of the time-sorted `start_hours`. Trials train on
+    the rows before `valid_start`.
+    """
+    hours = np.asarray(start_hours, dtype="datetime64[ns]")
+    end = hours[-1] + np.timedelta64(1, "h")
+    valid_stop_hour = end - np.timedelta64(holdout_days * 24, "h")
+    valid_start_hour = valid_stop_hour - np.timedelta64(valid_days * 24, "h")
+    valid_start, valid_stop = np.searchsorted(hours, [valid_start_hour, valid_stop_hour])
+    if valid_start == 0 or valid_start == valid_stop:
+        raise ValueError("Not enough history for a tuning split.")
+    return int(valid_start), int(valid_stop)
+
+
+def build_tuning_datasets(
+    model_input, targets, feature_names, valid_start: int, valid_stop: int, tuning_dir
+) -> Tuple[Path, Path]:
+    """
+    Bins the training rows `[0, valid_start)` of `model_input` into a
+    LightGBM Dataset and the validation rows `[valid_start, valid_stop)`
+    against the same bins, and saves both as LightGBM binary files in
+    `tuning_dir`. Returns their paths.
+    """
+    tuning_dir = Path(tuning_dir)
+    tuning_dir.mkdir(parents=True, exist_ok=True)
+    train_path, valid_path = tuning_dir / "train.bin", tuning_dir / "valid.bin"
+    for path in (train_path, valid_path):
+        path.unlink(missing_ok=True)
+
+    train = lgb.Dataset(
+        model_input[:valid_start],
+        label=np.asarray(targets[:valid_start]),
+        feature_name=list(feature_names),
+        params=DATASET_PARAMETERS,
+    )
+    valid = lgb.Dataset(
+        model_input[valid_start:valid_stop],
+        label=np.asarray(targets[valid_start:valid_stop]),
+        reference=train,
+    )
+    train.save_binary(str(train_path))
+    valid.save_binary(str(valid_path))
+    return train_path, valid_path
+
+
+# Datasets loaded by this worker process, reused by all of its trials
+_worker_datasets = None
+
+
+def _load_datasets(train_path, valid_path):
+    global _worker_datasets
+    if _worker_datasets is None:
+        train = lgb.Dataset(str(train_path), params=DATASET_PARAMETERS)
+        valid = lgb.Dataset(str(valid_path), reference=train)
+        _worker_datasets = train.construct(), valid.construct()
+    return _worker_datasets
+
+
+def _pruning_callback(trial: optuna.Trial, report_every: int, deadline: float):
+    def _callback(env):
+        if time.time() >= deadline:
+            raise optuna.TrialPruned("Tuning time budget spent.")
+        if (env.iteration + 1) % report_every:
+            return
+        trial.report(env.evaluation_result_list[0][2], step=env.iteration + 1)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    _callback.order = 40
+    return _callback
+
+
+def _objective(trial, train_path, valid_path, fixed_params, report_every, deadline, n_jobs):
+    params = {**fixed_params, **_suggest_parameters(trial), "metric": "l1", "n_jobs": n_jobs, "verbose": -1}
+    num_boost_round = params.pop("n_estimators")
+    train, valid = _load_datasets(train_path, valid_path)
+
+    evaluations = {}
+    lgb.train(
+        params,
+        train,
+        num_boost_round=num_boost_round,
+        valid_sets=[valid],
+        valid_names=["valid"],
+        callbacks=[
+            lgb.record_evaluation(evaluations),
+            _pruning_callback(trial, report_every, deadline),
+        ],
+    )
+    return evaluations["valid"]["l1"][-1]
+
+
+def _storage(journal_path) -> JournalStorage:
+    return JournalStorage(JournalFileBackend(str(journal_path)))
+
+
+def _pruner(report_every: int) -> optuna.pruners.MedianPruner:
+    # Let every trial boost a few reporting steps before it can be pruned
+    return optuna.pruners.MedianPruner(n_startup_trials=4, n_warmup_steps=2 * report_every)
+
+
+def _tune_worker(journal_path, train_path, valid_path, fixed_params, n_trials, report_every, deadline, n_jobs):
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(study_name=STUDY_NAME, storage=_storage(journal_path), pruner=_pruner(report_every))
+    study.optimize(
+        lambda trial: _objective(trial, train_path, valid_path, fixed_params, report_every, deadline, n_jobs),
+        timeout=max(0.0, deadline - time.time()),
+        callbacks=[
+            optuna.study.MaxTrialsCallback(
+                n_trials, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+            )
+        ],
+    )
+
+
+def tune_hyperparameters(
+    model_input,
+    targets,
+    feature_names,
+    start_hours,
+    tuning_dir,
+    seed_params: Dict,
+    n_trials: int = 50,
+    n_workers: Optional[int] = None,
+    time_budget_s: float = 3600,
+    report_every: int = 25,
+    valid_days: int = 7,
+    holdout_days: int = 7,
+) -> Tuple[Dict, pd.DataFrame]:
+    """
+    Searches LightGBM hyperparameters on the time-sorted `model_input`.
+
+    `seed_params` are the current parameters: they are evaluated as the
+    first trial, and the ones that are not searched (objective, seed, ...)
+    are kept in every trial. Returns the best parameters, in the
+    LGBMRegressor form of `seed_params`, and one row per trial.
+    """
+    valid_start, valid_stop = tuning_split(start_hours, valid_days, holdout_days)
+    train_path, valid_path = build_tuning_datasets(
+        model_input, targets, feature_names, valid_start, valid_stop, tuning_dir
+    )
+
+    journal_path = Path(tuning_dir) / "study.journal"
+    journal_path.unlink(missing_ok=True)
+    study = optuna.create_study(
+        study_name=STUDY_NAME, direction="minimize", storage=_storage(journal_path), pruner=_pruner(report_every)
+    )
+    study.enqueue_trial({name: seed_params[name] for name in SEARCHED_PARAMETERS if name in seed_params})
+
+    fixed_params = {name: value for name, value in seed_params.items() if name not in SEARCHED_PARAMETERS}
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, n_trials))
+    # Split the cores between the workers instead of oversubscribing them
+    n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+    args = (journal_path, train_path, valid_path, fixed_params, n_trials, report_every, time.time() + time_budget_s, n_jobs)
+
+    if n_workers == 1:
+        _tune_worker(*args)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for future in [executor.submit(_tune_worker, *args) for _ in range(n_workers)]:
+                future.result()
+
+    study = optuna.load_study(study_name=STUDY_NAME, storage=_storage(journal_path))
+    return {**seed_params, **study.best_params}, study.trials_dataframe()
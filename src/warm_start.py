@@ -0,0 +1,149 @@
+"""
+warm_start.py – incremental retraining from the registered booster.
+
+Instead of training all trees from scratch on 180 days, the weekly job can
+continue boosting the registered model on the windows that closed since it
+was last trained (`trained_until`, kept in its registry metrics):
+
+1. Only the history those windows need is fetched, and only the lag
+   columns the model reads are built.
+2. The registered model is scored on the new windows, which it has never
+   seen. If that error drifted more than `drift_tolerance` above its
+   reference `test_mae`, the update is abandoned for a full retrain.
+3. `extra_trees` trees are boosted on top of the registered booster on the
+   new windows, holding out the newest `validation_days`.
+4. The updated model is only kept if it beats the registered one on that
+   held-out period.
+
+A full retrain is also due every `full_retrain_every` incremental updates,
+or when the registered model predates these metrics.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+from sklearn.pipeline import Pipeline
+
+from src.data_utils import load_ts_windows_memmap, write_ts_windows_memmap
+from src.pipeline_utils import (
+    BoosterRegressor,
+    booster_parameters,
+    model_lags,
+    retrain_parameters,
+    write_model_input,
+)
+
+
+def full_retrain_reason(metrics: Dict, full_retrain_every: int, force: bool = False) -> Optional[str]:
+    """Why the registered model (with registry `metrics`) needs a full retrain, or None."""
+    if force:
+        return "requested with --full"
+    if "trained_until" not in metrics or "incremental_updates" not in metrics:
+        return "the registered model has no warm start metadata"
+    if metrics["incremental_updates"] >= full_retrain_every:
+        return f"{metrics['incremental_updates']} incremental updates since the last full retrain"
+    return None
+
+
+def _trained_until(metrics: Dict) -> pd.Timestamp:
+    return pd.Timestamp(metrics["trained_until"], unit="s")
+
+
+def history_days_needed(metrics: Dict, now, window_size: int = 24 * 28) -> int:
+    """Days of hourly history to fetch to build every window closed since `trained_until`."""
+    now = pd.Timestamp(now)
+    if now.tz is not None:
+        now = now.tz_convert("UTC").tz_localize(None)
+    span = now - _trained_until(metrics) + pd.Timedelta(hours=window_size + 24)
+    return int(np.ceil(span / pd.Timedelta(days=1)))
+
+
+def warm_start_update(
+    champion: Pipeline,
+    metrics: Dict,
+    ts_data: pd.DataFrame,
+    windows_dir,
+    extra_trees: int = 100,
+    validation_days: int = 1,
+    drift_tolerance: float = 0.15,
+    window_size: int = 24 * 28,
+    step_size: int = 1,
+) -> Tuple[Optional[Pipeline], Dict]:
+    """
+    Continues boosting the registered get_pipeline() pipeline `champion` on
+    the windows of `ts_data` whose target hour is after its `trained_until`.
+
+    Returns the updated pipeline, or None when it should not be registered,
+    and a report with the errors, the decision and the metrics to register.
+    `report["drift"]` tells that a full retrain is needed instead.
+    """
+    start = time.perf_counter()
+    trained_until = _trained_until(metrics)
+    write_ts_windows_memmap(
+        ts_data,
+        windows_dir,
+        window_size=window_size,
+        step_size=step_size,
+        sort_by_time=True,
+        lags=model_lags(champion),
+    )
+    windows = load_ts_windows_memmap(windows_dir)
+    model_input, feature_names = write_model_input(champion, windows, f"{windows_dir}/model_input.npy")
+
+    booster = champion[-1].booster_
+    if feature_names != booster.feature_name():
+        raise ValueError("The rebuilt model input does not match the registered model's features.")
+
+    hours = np.asarray(windows["start_hours"])
+    targets = np.asarray(windows["targets"])
+    new_start = int(np.searchsorted(hours, np.datetime64(trained_until), side="right"))
+    valid_start = int(np.searchsorted(hours, hours[-1] - np.timedelta64(validation_days * 24 - 1, "h")))
+    report = {
+        "new_rows": len(hours) - new_start,
+        "train_rows": max(0, valid_start - new_start),
+        "validation_rows": len(hours) - valid_start,
+    }
+    if valid_start <= new_start:
+        return None, dict(report, drift=False, reason="not enough new windows")
+
+    # Error of the registered model on windows it has never seen
+    recent_mae = mean_absolute_error(targets[new_start:], booster.predict(model_input[new_start:]))
+    reference_mae = metrics["test_mae"]
+    report.update(recent_mae=recent_mae, reference_mae=reference_mae)
+    if recent_mae > reference_mae * (1 + drift_tolerance):
+        return None, dict(report, drift=True, reason=f"MAE drifted from {reference_mae:.4f} to {recent_mae:.4f}")
+
+    regressor = BoosterRegressor({**booster_parameters(booster), "n_estimators": extra_trees}).fit(
+        model_input[new_start:valid_start],
+        targets[new_start:valid_start],
+        feature_name=feature_names,
+        init_model=booster,
+    )
+    # The full retrain parameters carry over, not this update's tree count
+    regressor.retrain_params_ = retrain_parameters(champion)
+
+    validation = slice(valid_start, None)
+    champion_mae = mean_absolute_error(targets[validation], booster.predict(model_input[validation]))
+    updated_mae = mean_absolute_error(targets[validation], regressor.predict(model_input[validation]))
+    report.update(
+        drift=False,
+        champion_mae=champion_mae,
+        updated_mae=updated_mae,
+        trees=regressor.booster_.current_iteration(),
+        elapsed_s=time.perf_counter() - start,
+        metrics={
+            "test_mae": reference_mae,
+            "latest_week_mae": updated_mae,
+            "incremental_updates": metrics["incremental_updates"] + 1,
+            "trained_until": pd.Timestamp(hours[valid_start - 1]).timestamp(),
+        },
+    )
+    if updated_mae >= champion_mae:
+        return None, dict(report, reason="the update did not beat the registered model")
+
+    # The feature steps are stateless and shared; only the last step is new
+    updated = Pipeline(champion.steps[:-1] + [("boosterregressor", regressor)])
+    return updated, dict(report, reason="the update beat the registered model")
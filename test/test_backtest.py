@@ -0,0 +1,20 @@
+import pandas as pd
+
+from src.backtest import walk_forward_folds
+
+
+def test_fold_with_a_gap_at_its_start_is_not_full_range():
+    hours = pd.date_range("2024-01-01", periods=24 * 60, freq="h")
+    # No data for the first three days of the newest test week
+    newest_week_start = hours[-1] + pd.Timedelta(hours=1) - pd.Timedelta(days=7)
+    gap = (hours >= newest_week_start) & (hours < newest_week_start + pd.Timedelta(days=3))
+    folds = walk_forward_folds(hours[~gap], n_folds=3, test_days=7)
+
+    assert [fold["full_range"] for fold in folds] == [True, True, False]
+
+
+def test_windows_a_step_apart_cover_the_whole_test_range():
+    hours = pd.date_range("2024-01-01", periods=24 * 60, freq="23h")
+    folds = walk_forward_folds(hours, n_folds=3, test_days=7, step_hours=23)
+
+    assert folds and all(fold["full_range"] for fold in folds)
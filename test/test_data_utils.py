@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_utils import (
+    transform_ts_data_info_features_and_target_bike,
+    transform_ts_data_latest_window_bike,
+)
+
+
+def _hourly_rides(n_stations=4, hours=200, seed=0):
+    rng = np.random.default_rng(seed)
+    start_hours = pd.date_range("2024-01-01", periods=hours, freq="h")
+    return pd.DataFrame(
+        {
+            "start_station_id": np.repeat([f"S{i}" for i in range(n_stations)], hours),
+            "start_hour": np.tile(start_hours, n_stations),
+            "rides": rng.poisson(3, n_stations * hours).astype("int64"),
+        }
+    )
+
+
+def _reference_windows(df, window_size, step_size):
+    # One window at a time, as the builders did before they used strided views
+    rows = []
+    for station_id in df["start_station_id"].unique():
+        station = df[df["start_station_id"] == station_id]
+        values, times = station["rides"].to_numpy(), station["start_hour"].to_numpy()
+        for i in range(0, len(values) - window_size, step_size):
+            rows.append([*values[i : i + window_size], times[i + window_size], station_id, values[i + window_size]])
+    columns = [f"rides_t-{window_size - i}" for i in range(window_size)] + ["start_hour", "start_station_id"]
+    reference = pd.DataFrame(rows, columns=columns + ["target"])
+    return reference[columns], reference["target"]
+
+
+def test_windows_match_a_window_by_window_build():
+    # Stations interleaved, plus one too short for a single window
+    rides = pd.concat([_hourly_rides(), _hourly_rides(n_stations=1, hours=50, seed=1).assign(start_station_id="short")])
+    rides = rides.sort_values("start_hour", kind="stable").reset_index(drop=True)
+
+    features, targets = transform_ts_data_info_features_and_target_bike(rides, window_size=72, step_size=5)
+    expected_features, expected_targets = _reference_windows(rides, window_size=72, step_size=5)
+    pd.testing.assert_frame_equal(features, expected_features, check_dtype=False)
+    pd.testing.assert_series_equal(targets, expected_targets, check_dtype=False)
+
+
+@pytest.mark.parametrize("lags", [None, [1, 24, 72]])
+def test_compact_windows_match_the_default_mode(lags):
+    rides = _hourly_rides()
+    features, targets = transform_ts_data_info_features_and_target_bike(
+        rides, window_size=72, step_size=5, lags=lags
+    )
+    compact_features, compact_targets = transform_ts_data_info_features_and_target_bike(
+        rides, window_size=72, step_size=5, dtype="float32", lags=lags
+    )
+
+    assert isinstance(compact_features["start_station_id"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(
+        compact_features.astype({"start_station_id": object}), features, check_dtype=False
+    )
+    np.testing.assert_array_equal(compact_targets, targets)
+
+
+def test_compact_latest_window_matches_the_default_mode():
+    rides = _hourly_rides()
+    features = transform_ts_data_latest_window_bike(rides, window_size=72)
+    compact_features = transform_ts_data_latest_window_bike(rides, window_size=72, dtype="float32")
+
+    pd.testing.assert_frame_equal(
+        compact_features.astype({"start_station_id": object}), features, check_dtype=False
+    )
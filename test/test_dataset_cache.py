@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from src.dataset_cache import DatasetCache
+
+
+def _model_input(n_rows=2000, n_features=5, seed=0):
+    rng = np.random.default_rng(seed)
+    model_input = rng.poisson(3, (n_rows, n_features)).astype(np.float32)
+    targets = rng.poisson(3, n_rows).astype(np.float32)
+    start_hours = pd.date_range("2024-01-01", periods=n_rows, freq="h").to_numpy()
+    return model_input, targets, [f"f{i}" for i in range(n_features)], start_hours
+
+
+def test_unchanged_data_is_a_hit(tmp_path):
+    model_input, targets, feature_names, start_hours = _model_input()
+    cache = DatasetCache(tmp_path)
+    cache.get(model_input, targets, feature_names, start_hours)
+    assert cache.last_status == "miss"
+
+    dataset = cache.get(model_input, targets, feature_names, start_hours)
+    assert cache.last_status == "hit"
+    np.testing.assert_array_equal(dataset.get_label(), targets)
+
+
+def test_backfilled_rows_in_the_same_range_are_not_a_hit(tmp_path):
+    model_input, targets, feature_names, start_hours = _model_input()
+    cache = DatasetCache(tmp_path)
+    cache.get(model_input, targets, feature_names, start_hours)
+
+    # A recount changes labels inside the cached hour range
+    backfilled = targets.copy()
+    backfilled[100:110] += 1
+    dataset = cache.get(model_input, backfilled, feature_names, start_hours)
+    assert cache.last_status != "hit"
+    np.testing.assert_array_equal(dataset.get_label(), backfilled)
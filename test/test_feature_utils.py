@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+from src.feature_utils import (
+    add_lag_features,
+    add_lag_features_and_calendar_flags,
+    build_features_for_citibike,
+    build_incremental_features_for_citibike,
+    save_feature_state,
+)
+
+PRIMARY_KEY = ["start_station_id", "start_hour"]
+
+
+def _trips(start, hours, stations=("A", "B", "C"), seed=0):
+    rng = np.random.default_rng(seed)
+    n_trips = 40 * hours
+    started_at = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, hours * 3600, n_trips), unit="s")
+    # Every station has a trip in the first hour, so all of them are known
+    # to the first (full) build
+    started_at = pd.DatetimeIndex([pd.Timestamp(start)] * len(stations)).append(started_at)
+    station_ids = np.concatenate([list(stations), rng.choice(stations, n_trips)])
+    return pd.DataFrame({"started_at": started_at, "start_station_id": station_ids})
+
+
+def _write_trips(path, start, hours, stations=("A", "B", "C"), seed=0):
+    _trips(start, hours, stations, seed).to_parquet(path)
+
+
+def _upsert(*batches):
+    rows = pd.concat(batches, ignore_index=True).drop_duplicates(PRIMARY_KEY, keep="last")
+    return rows.sort_values(PRIMARY_KEY).reset_index(drop=True)
+
+
+def test_incremental_features_equal_full_rebuild(tmp_path):
+    start = pd.Timestamp("2023-03-01")
+    first_end = start + pd.Timedelta(hours=30 * 24)
+    second_end = first_end + pd.Timedelta(hours=7)
+    trips_path = tmp_path / "trips.parquet"
+    state_path = tmp_path / "state.parquet"
+    _write_trips(trips_path, start, hours=31 * 24)
+
+    # A full build, then one incremental run on top of its state
+    first = build_features_for_citibike(start, first_end, trips_path, counts_dir=tmp_path / "counts", lags=[1, 24, 672])
+    save_feature_state(first, state_path, first_end)
+    incremental, history = build_incremental_features_for_citibike(
+        second_end, trips_path, state_path, counts_dir=tmp_path / "counts", lags=[1, 24, 672]
+    )
+    assert incremental["start_hour"].min() == first_end - pd.Timedelta(hours=1)
+    assert incremental["start_hour"].max() == second_end - pd.Timedelta(hours=1)
+
+    rebuilt = build_features_for_citibike(
+        start, second_end, trips_path, counts_dir=tmp_path / "rebuilt_counts", lags=[1, 24, 672]
+    )
+    pd.testing.assert_frame_equal(_upsert(first, incremental), _upsert(rebuilt), check_dtype=False)
+
+
+def test_incremental_features_follow_stations_that_come_and_go(tmp_path):
+    start = pd.Timestamp("2023-03-01")
+    first_end = start + pd.Timedelta(hours=60 * 24)
+    second_end = first_end + pd.Timedelta(hours=7)
+    trips_path = tmp_path / "trips.parquet"
+    state_path = tmp_path / "state.parquet"
+    # D stops after the first week, E opens after the state is saved
+    trips = pd.concat(
+        [
+            _trips(start, hours=61 * 24, stations=("A", "B")),
+            _trips(start, hours=7 * 24, stations=("D",), seed=1),
+            _trips(first_end + pd.Timedelta(hours=2), hours=5, stations=("E",), seed=2),
+        ]
+    )
+    trips.to_parquet(trips_path)
+
+    first = build_features_for_citibike(start, first_end, trips_path, counts_dir=tmp_path / "counts", lags=[1, 24, 672])
+    save_feature_state(first, state_path, first_end)
+    assert set(pd.read_parquet(state_path)["start_station_id"]) == {"A", "B"}
+
+    incremental, _ = build_incremental_features_for_citibike(
+        second_end, trips_path, state_path, counts_dir=tmp_path / "counts", lags=[1, 24, 672]
+    )
+    rebuilt = build_features_for_citibike(
+        start, second_end, trips_path, counts_dir=tmp_path / "rebuilt_counts", lags=[1, 24, 672]
+    )
+    rebuilt = rebuilt[
+        (rebuilt["start_hour"] >= incremental["start_hour"].min()) & (rebuilt["start_station_id"] != "D")
+    ]
+    assert set(incremental["start_station_id"]) == {"A", "B", "E"}
+    pd.testing.assert_frame_equal(_upsert(incremental), _upsert(rebuilt), check_dtype=False)
+
+
+def test_last_closed_hour_has_no_target_yet(tmp_path):
+    start = pd.Timestamp("2023-03-01")
+    end = start + pd.Timedelta(hours=48)
+    trips_path = tmp_path / "trips.parquet"
+    _write_trips(trips_path, start, hours=48)
+
+    features = build_features_for_citibike(start, end, trips_path, counts_dir=tmp_path / "counts", lags=[1])
+    assert features["start_hour"].max() == end - pd.Timedelta(hours=1)
+    last_hour = features[features["start_hour"] == features["start_hour"].max()]
+    assert last_hour["target_t_plus_1"].isna().all()
+
+
+def test_ranges_without_trips_build_without_error(tmp_path):
+    start = pd.Timestamp("2023-03-01")
+    trips_path = tmp_path / "trips.parquet"
+    state_path = tmp_path / "state.parquet"
+    _write_trips(trips_path, start, hours=24)
+
+    # A later range has no trips, so the counts table only gets a watermark
+    empty_start = pd.Timestamp("2023-04-01")
+    features = build_features_for_citibike(
+        empty_start, empty_start + pd.Timedelta(hours=48), trips_path, counts_dir=tmp_path / "empty", lags=[1]
+    )
+    assert features.empty
+
+    # Hours without trips after a saved state are zero-filled for its stations
+    first = build_features_for_citibike(
+        start, start + pd.Timedelta(hours=24), trips_path, counts_dir=tmp_path / "counts", lags=[1]
+    )
+    save_feature_state(first, state_path, start + pd.Timedelta(hours=24))
+    incremental, _ = build_incremental_features_for_citibike(
+        start + pd.Timedelta(hours=30), trips_path, state_path, counts_dir=tmp_path / "later", lags=[1]
+    )
+    new_hours = incremental[incremental["start_hour"] >= start + pd.Timedelta(hours=24)]
+    assert len(new_hours) == 3 * 6 and (new_hours["rides"] == 0).all()
+
+
+def test_lag_block_matches_groupby_shift():
+    rng = np.random.default_rng(0)
+    hours = pd.date_range("2023-03-01", periods=100, freq="h")
+    # Stations of different lengths, so lags reach past some stations' start
+    df = pd.concat(
+        [
+            pd.DataFrame({"start_station_id": station, "start_hour": hours[:n], "rides": rng.poisson(3, n)})
+            for station, n in [("A", 100), ("B", 30), ("C", 70)]
+        ],
+        ignore_index=True,
+    )
+    lags = [1, 2, 24, 48, 72]
+
+    lagged = add_lag_features(df, lags=lags)
+    features = add_lag_features_and_calendar_flags(df, lags=lags)
+    for lag in lags:
+        expected = df.groupby("start_station_id")["rides"].shift(lag).rename(f"lag_{lag}")
+        pd.testing.assert_series_equal(lagged[f"lag_{lag}"], expected, check_dtype=False)
+        pd.testing.assert_series_equal(features[f"lag_{lag}"], expected, check_dtype=False)
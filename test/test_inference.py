@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.config as config
+from src.data_utils import transform_ts_data_info_features_and_target_bike
+from src.local_store import LocalFeatureStore, LocalProject
+from src.pipeline_utils import get_pipeline
+from src.inference import (
+    fetch_forecast_predictions,
+    fetch_next_hour_predictions,
+    get_feature_store,
+    get_hopsworks_session_stats,
+    get_model_predictions,
+    reset_hopsworks_session,
+    write_forecast_predictions,
+)
+
+
+class _ConstantForecaster:
+    """Predicts `station index + horizon / 100` for every hour ahead."""
+
+    def __init__(self, horizon):
+        self.horizon = horizon
+
+    def predict(self, features):
+        return np.arange(len(features))[:, None] + np.arange(1, self.horizon + 1)[None, :] / 100
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FEATURE_STORE_BACKEND", "local")
+    monkeypatch.setattr(config, "LOCAL_FEATURE_STORE_DIR", tmp_path)
+    reset_hopsworks_session()
+    yield tmp_path
+    reset_hopsworks_session()
+
+
+@pytest.mark.parametrize("minute", [0, 37])
+def test_forecast_write_then_read_returns_every_hour(local_store, minute):
+    horizon = 24
+    current_date = pd.Timestamp("2024-05-01 10:00", tz="Etc/UTC") + pd.Timedelta(minutes=minute)
+    features = pd.DataFrame(
+        {
+            "start_station_id": ["A", "B", "C"],
+            "start_hour": pd.Timestamp("2024-05-01 10:00"),
+        }
+    )
+    predictions = get_model_predictions(_ConstantForecaster(horizon), features)
+    write_forecast_predictions(predictions, features, current_date)
+
+    # The windows predict 10:00 first, whatever minute the job runs at
+    forecasts = fetch_forecast_predictions(horizon, current_date=current_date)
+    first_hour = pd.Timestamp("2024-05-01 10:00", tz="Etc/UTC")
+    assert len(forecasts) == 3 * horizon
+    assert sorted(forecasts["prediction_hour"].unique()) == list(
+        pd.date_range(first_hour, periods=horizon, freq="h")
+    )
+    hours_ahead = (forecasts["prediction_hour"] - first_hour) // pd.Timedelta(hours=1) + 1
+    assert (hours_ahead == forecasts["horizon"]).all()
+
+
+def test_next_hour_cache_follows_the_latest_predictions(local_store, monkeypatch):
+    cache_dir = local_store / "prediction_cache"
+    monkeypatch.setattr(config, "PREDICTION_CACHE_DIR", cache_dir)
+    cache_dir.mkdir()
+    (cache_dir / "2024050110_0.parquet").touch()
+
+    fg = get_feature_store().get_or_create_feature_group(
+        name=config.FEATURE_GROUP_MODEL_PREDICTION,
+        version=1,
+        primary_key=["start_station_id", "prediction_hour"],
+        event_time="prediction_hour",
+    )
+    current_hour = pd.Timestamp.now(tz="UTC").floor("h")
+    rows = pd.DataFrame({"start_station_id": ["A", "B"], "prediction_hour": current_hour, "predicted_demand": [1, 2]})
+    fg.insert(rows)
+    assert fetch_next_hour_predictions()["predicted_demand"].tolist() == [1, 2]
+    assert len(list(cache_dir.glob("*.parquet"))) == 1
+
+    # A rerun of the inference pipeline replaces the cached predictions
+    fg.insert(rows.assign(predicted_demand=[3, 4]))
+    assert fetch_next_hour_predictions()["predicted_demand"].tolist() == [3, 4]
+    assert len(list(cache_dir.glob("*.parquet"))) == 1
+
+
+def test_feature_store_logs_in_again_after_a_connection_error(local_store, monkeypatch):
+    projects = []
+
+    def expiring_feature_store(project):
+        projects.append(project)
+        if len(projects) == 1:
+            raise ConnectionError("session expired")
+        return LocalFeatureStore(local_store)
+
+    monkeypatch.setattr(LocalProject, "get_feature_store", expiring_feature_store)
+    before = get_hopsworks_session_stats()
+    assert isinstance(get_feature_store(), LocalFeatureStore)
+
+    after = get_hopsworks_session_stats()
+    assert projects[0] is not projects[1]
+    assert after["logins"] - before["logins"] == 2
+    assert after["reconnects"] - before["reconnects"] == 1
+
+
+def test_compact_predictions_match_the_default_mode():
+    # Four weeks plus a day of hourly rides for three stations
+    rng = np.random.default_rng(0)
+    hours = pd.date_range("2024-01-01", periods=24 * 29, freq="h")
+    rides = pd.DataFrame(
+        {
+            "start_station_id": np.repeat(["A", "B", "C"], len(hours)),
+            "start_hour": np.tile(hours, 3),
+            "rides": rng.poisson(3, 3 * len(hours)).astype("int64"),
+        }
+    )
+    features, targets = transform_ts_data_info_features_and_target_bike(rides, window_size=672, step_size=7)
+    model = get_pipeline(n_estimators=10, verbose=-1).fit(features, targets)
+    compact_features, _ = transform_ts_data_info_features_and_target_bike(
+        rides, window_size=672, step_size=7, dtype="float32"
+    )
+
+    predictions = get_model_predictions(model, features)
+    compact_predictions = get_model_predictions(model, compact_features)
+    assert compact_predictions["start_station_id"].dtype == object
+    pd.testing.assert_frame_equal(compact_predictions, predictions)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from src.data_utils import load_ts_windows_memmap, write_ts_windows_memmap
+from src.pipeline_utils import BoosterRegressor, get_pipeline, retrain_parameters, write_model_input
+from src.warm_start import warm_start_update
+
+LAGS = [672, 504, 336, 168, 24, 1]
+
+
+def _hourly_rides(n_stations=20, days=60, shift_from="2024-02-20", seed=0):
+    # Demand jumps by 25% at `shift_from`, so a warm-start update pays off
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range("2024-01-01", periods=24 * days, freq="h")
+    rate = (3 + 2 * np.sin(2 * np.pi * hours.hour / 24)) * np.where(hours >= pd.Timestamp(shift_from), 1.25, 1.0)
+    return pd.DataFrame(
+        {
+            "start_station_id": np.repeat([f"S{i}" for i in range(n_stations)], len(hours)),
+            "start_hour": np.tile(hours.values, n_stations),
+            "rides": rng.poisson(np.tile(rate, n_stations)),
+        }
+    )
+
+
+def test_warm_start_keeps_the_full_retrain_parameters(tmp_path):
+    rides = _hourly_rides()
+    cutoff = pd.Timestamp("2024-02-20")
+    write_ts_windows_memmap(
+        rides[rides["start_hour"] < cutoff], tmp_path / "full", window_size=672, step_size=5, sort_by_time=True
+    )
+    windows = load_ts_windows_memmap(tmp_path / "full")
+    params = {"n_estimators": 50, "num_leaves": 15, "objective": "regression_l1", "random_state": 42}
+    pipeline = get_pipeline(feature_dtype="float32", lag_columns=[f"rides_t-{lag}" for lag in LAGS])
+    model_input, feature_names = write_model_input(pipeline, windows, tmp_path / "model_input.npy")
+    pipeline.steps[-1] = (
+        "boosterregressor",
+        BoosterRegressor(params).fit(model_input, np.asarray(windows["targets"]), feature_name=feature_names),
+    )
+
+    metrics = {
+        "test_mae": 1.5,
+        "incremental_updates": 0,
+        "trained_until": pd.Timestamp(windows["start_hours"][-1]).timestamp(),
+    }
+    recent = rides[rides["start_hour"] >= cutoff - pd.Timedelta(days=29)]
+    updated, report = warm_start_update(pipeline, metrics, recent, tmp_path / "warm", extra_trees=20)
+
+    assert updated is not None, report["reason"]
+    assert updated[-1].booster_.current_iteration() == 70
+    assert retrain_parameters(updated) == params
+    assert retrain_parameters(pipeline) == params